@@ -0,0 +1,93 @@
+"""
+Activity feed of a user.
+
+The items, photos, comments and ratings of the user are merged into one feed, newest first. Entries are ordered by
+(timestamp, kind rank, id) so that the order is total, and pages are cut by keyset: a cursor holds the key of the last
+entry of a page, every source is read from it with a bounded, column pruned query and the sources are merged.
+"""
+
+import base64
+import heapq
+
+from django.db.models import F, Q, ExpressionWrapper, FloatField
+from django.utils.dateparse import parse_datetime
+
+from item.models import Item, Photo, Comment, Rating
+
+KINDS = ['item', 'photo', 'comment', 'rating']
+
+MAX_PAGE_SIZE = 200
+
+
+def _get_sources(profile_id):
+    """
+    Returns the queryset of (id, timestamp, title, xp) rows of every kind
+    """
+
+    xp = ExpressionWrapper(F('rating') * 2 - F('flags') * 10, output_field=FloatField())
+    return {
+        'item': Item.objects.filter(author_id=profile_id).annotate(xp=xp).values_list('id', 'timestamp', 'title', 'xp'),
+        'photo': Photo.objects.filter(author_id=profile_id).values_list('id', 'timestamp', 'item__title',
+                                                                        'experience'),
+        'comment': Comment.objects.filter(author_id=profile_id).values_list('id', 'timestamp', 'item__title',
+                                                                            'experience'),
+        # Ratings made before they had a timestamp cannot be placed in the feed
+        'rating': Rating.objects.filter(author_id=profile_id, timestamp__isnull=False)
+            .values_list('id', 'timestamp', 'item__title'),
+    }
+
+
+def encode_cursor(timestamp, rank, entry_id):
+    value = '%s|%d|%d' % (timestamp.isoformat(), rank, entry_id)
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (timestamp, rank, id) key of the cursor, raises ValueError for invalid cursors
+    """
+
+    try:
+        timestamp, rank, entry_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    except (TypeError, UnicodeError, base64.binascii.Error):
+        raise ValueError('Invalid cursor')
+    timestamp = parse_datetime(timestamp)
+    if timestamp is None:
+        raise ValueError('Invalid cursor')
+    return timestamp, int(rank), int(entry_id)
+
+
+def _before(rows, rank, cursor):
+    """
+    Filters the rows of a kind down to the ones which come after the cursor in the feed
+    """
+
+    timestamp, cursor_rank, entry_id = cursor
+    if rank < cursor_rank:
+        return rows.filter(timestamp__lte=timestamp)
+    if rank > cursor_rank:
+        return rows.filter(timestamp__lt=timestamp)
+    return rows.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=entry_id))
+
+
+def get_activity(profile_id, cursor=None, limit=50):
+    """
+    Returns a page of at most `limit` activity entries, newest first, and the cursor of the next page or None
+    """
+
+    sources = _get_sources(profile_id)
+    streams = []
+    for rank, kind in enumerate(KINDS):
+        rows = sources[kind]
+        if cursor is not None:
+            rows = _before(rows, rank, cursor)
+        rows = rows.order_by('-timestamp', '-id')[:limit + 1]
+        streams.append([((row[1], rank, row[0]), kind, row) for row in rows])
+
+    entries = []
+    for key, kind, row in heapq.merge(*streams, reverse=True):
+        if len(entries) == limit:
+            return entries, encode_cursor(*entries[-1]['key'])
+        entries.append({'key': key, 'type': kind, 'id': row[0], 'timestamp': row[1], 'title': row[2],
+                        'xp': row[3] if len(row) > 3 else 0})
+    return entries, None
@@ -1,5 +1,26 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class AccountConfig(AppConfig):
     name = 'account'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+
+        from account import profiles, stats, tokens
+        from account.models import UserProfile, UserToken
+
+        post_save.connect(profiles.update_profile_id, sender=UserProfile, dispatch_uid='account.update_profile_id')
+        post_delete.connect(profiles.forget_profile_id, sender=UserProfile,
+                            dispatch_uid='account.forget_profile_id')
+
+        post_save.connect(profiles.mark_saved_profile, sender=UserProfile, dispatch_uid='account.mark_saved_profile')
+        post_save.connect(profiles.mark_saved_user, sender=User, dispatch_uid='account.mark_saved_user')
+        post_save.connect(stats.forget_saved_user, sender=User, dispatch_uid='account.forget_saved_user_profile')
+        post_save.connect(tokens.forget_saved_token, sender=UserToken, dispatch_uid='account.forget_saved_token')
+        post_delete.connect(tokens.forget_deleted_token, sender=UserToken, dispatch_uid='account.forget_deleted_token')
+
+        for signal in [post_save, post_delete]:
+            signal.connect(stats.forget_saved_profile, sender=UserProfile, dispatch_uid='account.forget_saved_profile')
+            signal.connect(tokens.forget_saved_user, sender=User, dispatch_uid='account.forget_saved_user')
@@ -0,0 +1,78 @@
+"""
+Facebook Graph API client for the login.
+
+Calls share one keep-alive `requests.Session` per process and are bounded by `GRAPH_CONNECT_TIMEOUT` and
+`GRAPH_READ_TIMEOUT`. The user of a verified access token is cached for `GRAPH_TOKEN_CACHE_TIMEOUT` seconds, under a
+hash of the token, so a client logging in again right away does not wait on Facebook.
+"""
+
+import hashlib
+import threading
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from project_hermes.hermes_config import Configurations
+
+USER_FIELDS = 'id,first_name,last_name,picture.height(256),email'
+
+
+class GraphAPIError(Exception):
+    """
+    The access token was refused
+    """
+
+
+class GraphUnavailable(Exception):
+    """
+    Facebook could not be reached in time
+    """
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Configurations.GRAPH_POOL_SIZE, max_retries=0)
+            _session = requests.Session()
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def _token_key(access_token):
+    return 'account:graph:me:%s' % hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
+
+def get_user(access_token):
+    """
+    Returns the Facebook user of the access token, raises GraphAPIError for invalid tokens and GraphUnavailable
+    when Facebook does not answer in time
+    """
+
+    key = _token_key(access_token)
+    fb_user = cache.get(key)
+    if fb_user is not None:
+        return fb_user
+
+    try:
+        response = get_session().get(settings.GRAPH_API_URL + '/me',
+                                     params={'fields': USER_FIELDS, 'access_token': access_token},
+                                     timeout=(Configurations.GRAPH_CONNECT_TIMEOUT, Configurations.GRAPH_READ_TIMEOUT))
+        fb_user = response.json()
+    except (requests.RequestException, ValueError) as error:
+        raise GraphUnavailable(str(error))
+
+    if response.status_code != 200 or 'error' in fb_user or 'id' not in fb_user:
+        if response.status_code >= 500:
+            raise GraphUnavailable(response.text)
+        raise GraphAPIError(fb_user.get('error', {}).get('message', 'Invalid token'))
+
+    cache.set(key, fb_user, Configurations.GRAPH_TOKEN_CACHE_TIMEOUT)
+    return fb_user
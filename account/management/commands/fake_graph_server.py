@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from django.core.management.base import BaseCommand
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class GraphHandler(BaseHTTPRequestHandler):
+    """
+    Answers `/<version>/me` like the Graph API, with a user derived from the access token. Tokens starting with
+    'invalid' are refused.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        access_token = parse_qs(url.query).get('access_token', [''])[0]
+        time.sleep(self.latency)
+
+        if not url.path.endswith('/me'):
+            self.respond(404, {'error': {'message': 'Unknown path', 'type': 'GraphMethodException', 'code': 100}})
+        elif not access_token or access_token.startswith('invalid'):
+            self.respond(400, {'error': {'message': 'Invalid OAuth access token.', 'type': 'OAuthException',
+                                         'code': 190}})
+        else:
+            digest = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+            self.respond(200, {
+                'id': str(int(digest[:12], 16)),
+                'first_name': 'Test',
+                'last_name': digest[:8],
+                'email': '%s@example.com' % digest[:16],
+                'picture': {'data': {'is_silhouette': True, 'url': 'https://example.com/%s.jpg' % digest[:16]}},
+            })
+
+    def respond(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Runs a local stand-in of the Facebook Graph API for offline logins and login benchmarks. ' \
+           'Start the server with GRAPH_API_URL=http://127.0.0.1:<port>/v2.5'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds to wait before every answer, to mimic the round trip to Facebook')
+
+    def handle(self, *args, **options):
+        GraphHandler.latency = options['latency']
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), GraphHandler)
+        self.stdout.write('Fake Graph API on http://127.0.0.1:%d/v2.5' % options['port'])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from account.models import UserToken
+from account.tokens import expire_tokens
+from project_hermes.hermes_config import Configurations
+
+
+class Command(BaseCommand):
+    help = 'Expires the tokens which were not used for TOKEN_EXPIRY_DAYS and deletes the expired tokens, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Run again every INTERVAL seconds instead of once')
+        parser.add_argument('--vacuum', action='store_true', default=False,
+                            help='Vacuum the token table afterwards to reclaim its space, on PostgreSQL')
+
+    def handle(self, *args, **options):
+        while True:
+            self.purge(options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def purge(self, options):
+        started = time.time()
+        cutoff = timezone.now() - timedelta(days=Configurations.TOKEN_EXPIRY_DAYS)
+
+        expired = 0
+        while True:
+            ids = list(UserToken.objects.filter(has_expired=False, last_accessed__lt=cutoff).order_by('last_accessed')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            expired += expire_tokens(UserToken.objects.filter(pk__in=ids))
+
+        deleted = 0
+        while True:
+            ids = list(UserToken.objects.filter(has_expired=True).order_by('last_accessed')
+                       .values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            # Nothing references the tokens and expired tokens left the caches when they expired, so they are
+            # deleted in one statement, without loading them for the post_delete receivers
+            deleted += UserToken.objects.filter(pk__in=ids)._raw_delete(UserToken.objects.db)
+
+        if options['vacuum'] and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM ANALYZE %s' % connection.ops.quote_name(UserToken._meta.db_table))
+
+        self.stdout.write('Expired %d tokens, deleted %d in %.2f seconds' % (expired, deleted,
+                                                                            time.time() - started))
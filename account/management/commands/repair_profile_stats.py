@@ -0,0 +1,14 @@
+from account.models import UserProfile
+from account.stats import repair_stats
+from project_hermes.batch_command import BatchCommand
+
+
+class Command(BatchCommand):
+    help = 'Recounts the items, photos, comments and ratings of every user and repairs the stored counts'
+    subject = 'users'
+
+    def get_queryset(self, options):
+        return UserProfile.objects.values_list('id', flat=True)
+
+    def handle_batch(self, ids, options):
+        return repair_stats(ids)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:08
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_auto_20160408_1410'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='usertoken',
+            index_together=set([('has_expired', 'last_accessed')]),
+        ),
+    ]
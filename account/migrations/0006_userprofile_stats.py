@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_stats(apps, schema_editor):
+    UserProfile = apps.get_model('account', 'UserProfile')
+    counted_models = {
+        'items_count': apps.get_model('item', 'Item'),
+        'photos_count': apps.get_model('item', 'Photo'),
+        'comments_count': apps.get_model('item', 'Comment'),
+        'ratings_count': apps.get_model('item', 'Rating'),
+    }
+
+    for field, model in counted_models.items():
+        counts = model.objects.order_by().values_list('author_id').annotate(count=Count('pk'))
+        for profile_id, count in counts.iterator():
+            UserProfile.objects.filter(pk=profile_id).update(**{field: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0005_usertoken_expiry_index'),
+        ('item', '0018_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='comments_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='items_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='photos_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='ratings_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
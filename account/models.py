@@ -4,6 +4,7 @@ import uuid
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import F
 from django.utils import timezone
 
 
@@ -11,10 +12,26 @@ class UserProfile(models.Model):
     user = models.ForeignKey(User)
     picture = models.URLField(blank=True, max_length=1024)
     reputation = models.FloatField(default=0)
+    # Maintained by the write paths with atomic updates, see account.stats
+    items_count = models.IntegerField(default=0, editable=False)
+    photos_count = models.IntegerField(default=0, editable=False)
+    comments_count = models.IntegerField(default=0, editable=False)
+    ratings_count = models.IntegerField(default=0, editable=False)
+    # Moved by every change to the serialized profile, for the conditional reads of the items which embed it
+    version = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return self.user.first_name + '[' + self.user.email + ']'
 
+    @staticmethod
+    def changed(**values):
+        """
+        Returns the update of the values which also marks the profile changed, in the same statement
+        """
+
+        return dict(values, version=F('version') + 1, updated_at=timezone.now())
+
 class UserToken(models.Model):
     user = models.ForeignKey(User)
     token = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True, unique=True)
@@ -22,18 +39,6 @@ class UserToken(models.Model):
     last_accessed = models.DateTimeField(default=timezone.now)
     has_expired = models.BooleanField(default=False)
 
-    def is_active(self):
-        if self.has_expired:
-            return False
-
-        current_date = timezone.now()
-        diff = abs((current_date - self.last_accessed).days)
-
-        if diff > 30:
-            self.has_expired = True
-            self.save()
-            return False
-        else:
-            self.last_accessed = current_date
-            self.save()
-            return True
\ No newline at end of file
+    class Meta:
+        index_together = [['has_expired', 'last_accessed']]
+
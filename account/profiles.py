@@ -0,0 +1,74 @@
+"""
+Profile of the authenticated user.
+
+The profile is looked up at most once per request and kept on the user object of the request. The profile id of
+every user is also cached across requests, since it never changes while the profile exists, so most requests
+only need the id and do not query the profile at all.
+"""
+
+from django.core.cache import cache
+
+from account.models import UserProfile
+from project_hermes.hermes_config import Configurations
+
+
+def _profile_id_key(user_id):
+    return 'account:profile:id:%d' % user_id
+
+
+def get_profile_id(user):
+    """
+    Returns the id of the profile of the user, None for anonymous users and users without a profile
+    """
+
+    if not getattr(user, 'pk', None):
+        return None
+    if hasattr(user, '_profile'):
+        return user._profile.pk if user._profile else None
+    if not hasattr(user, '_profile_id'):
+        user._profile_id = cache.get(_profile_id_key(user.pk))
+        if user._profile_id is None:
+            user._profile_id = UserProfile.objects.filter(user_id=user.pk).values_list('id', flat=True).first()
+            if user._profile_id is not None:
+                cache.set(_profile_id_key(user.pk), user._profile_id, Configurations.PROFILE_ID_CACHE_TIMEOUT)
+    return user._profile_id
+
+
+def get_profile(user):
+    """
+    Returns the profile of the user, loaded once per request
+    """
+
+    if not hasattr(user, '_profile'):
+        profile_id = get_profile_id(user)
+        user._profile = None
+        if profile_id is not None:
+            # Users authenticated by token only hold the columns authentication needs, see account.tokens
+            deferred = bool(user.get_deferred_fields())
+            profiles = UserProfile.objects.select_related('user') if deferred else UserProfile.objects
+            user._profile = profiles.filter(pk=profile_id).first()
+            if user._profile is not None and not deferred:
+                user._profile.user = user
+    return user._profile
+
+
+# Columns of the user which are part of the serialized profile
+SERIALIZED_USER_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
+def mark_saved_profile(sender, instance, created, **kwargs):
+    if not created:
+        UserProfile.objects.filter(pk=instance.pk).update(**UserProfile.changed())
+
+
+def mark_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    if not created and (update_fields is None or SERIALIZED_USER_FIELDS.intersection(update_fields)):
+        UserProfile.objects.filter(user_id=instance.pk).update(**UserProfile.changed())
+
+
+def update_profile_id(sender, instance, created, **kwargs):
+    cache.set(_profile_id_key(instance.user_id), instance.pk, Configurations.PROFILE_ID_CACHE_TIMEOUT)
+
+
+def forget_profile_id(sender, instance, **kwargs):
+    cache.delete(_profile_id_key(instance.user_id))
@@ -1,7 +1,6 @@
 from rest_framework import serializers
 
 from account.models import UserProfile
-from item.models import Photo, Comment, Rating, Item
 from project_hermes.hermes_config import Configurations
 
 
@@ -13,13 +12,14 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserProfile
+        exclude = ('items_count', 'photos_count', 'comments_count', 'ratings_count', 'version', 'updated_at')
 
 class UserDetailsProfileSerializer(UserProfileSerializer):
     level = serializers.SerializerMethodField()
-    items = serializers.SerializerMethodField()
-    photos = serializers.SerializerMethodField()
-    comments = serializers.SerializerMethodField()
-    ratings = serializers.SerializerMethodField()
+    items = serializers.IntegerField(source='items_count')
+    photos = serializers.IntegerField(source='photos_count')
+    comments = serializers.IntegerField(source='comments_count')
+    ratings = serializers.IntegerField(source='ratings_count')
 
     def get_level(self, profile):
         if profile.reputation < Configurations.BANNED:
@@ -35,55 +35,16 @@ class UserDetailsProfileSerializer(UserProfileSerializer):
         else:
             return {'type': 4, 'title': 'Expert'}
 
-    def get_photos(self, profile):
-        return Photo.objects.filter(author=profile).count()
+class UserActivitySerializer(serializers.Serializer):
+    """
+    Entry of the activity feed of a user, see account.activity
+    """
 
-    def get_items(self, profile):
-        return Item.objects.filter(author=profile).count()
-
-    def get_comments(self, profile):
-        return Comment.objects.filter(author=profile).count()
-
-    def get_ratings(self, profile):
-        return Rating.objects.filter(author=profile).count()
-
-class UserActivitySerializer(UserProfileSerializer):
-    items = serializers.SerializerMethodField()
-    photos = serializers.SerializerMethodField()
-    comments = serializers.SerializerMethodField()
-    ratings = serializers.SerializerMethodField()
-
-    def get_photos(self, profile):
-        photos = Photo.objects.filter(author=profile).prefetch_related('item')
-        response = []
-        for photo in photos:
-            response.append({'title': photo.item.title, 'timestamp': photo.timestamp,
-                             'id': photo.id, 'xp': photo.experience})
-        return response
-
-    def get_items(self, profile):
-        items = Item.objects.filter(author=profile)
-        response = []
-        for item in items:
-            response.append({'title': item.title, 'timestamp': item.timestamp,
-                             'id': item.id, 'xp': (item.rating * 2 - item.flags * 10)})
-        return response
-
-    def get_comments(self, profile):
-        comments = Comment.objects.filter(author=profile).prefetch_related('item')
-        response = []
-        for comment in comments:
-            response.append({'title': comment.item.title, 'timestamp': comment.timestamp,
-                             'id': comment.id, 'xp': comment.experience})
-        return response
-
-    def get_ratings(self, profile):
-        ratings = Rating.objects.filter(author=profile).prefetch_related('item')
-        response = []
-        for rating in ratings:
-            response.append({'title': rating.item.title, 'timestamp': rating.timestamp,
-                             'id': rating.id, 'xp': 0})
-        return response
+    type = serializers.CharField()
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    timestamp = serializers.DateTimeField()
+    xp = serializers.FloatField()
 
 
 class LoginSerializer(serializers.Serializer):
@@ -0,0 +1,84 @@
+"""
+Contribution counts of the users.
+
+The counts are columns of `UserProfile`, changed by the write paths with `add_stats`. `compute_stats` recounts
+them for repairs, and the serialized profile is cached for `PROFILE_CACHE_TIMEOUT` seconds.
+"""
+
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from account.models import UserProfile
+from account.profiles import get_profile_id
+from item.models import Item, Photo, Comment, Rating
+from project_hermes.hermes_config import Configurations
+
+counted_models = {
+    'items_count': Item,
+    'photos_count': Photo,
+    'comments_count': Comment,
+    'ratings_count': Rating,
+}
+
+
+def _profile_key(profile_id):
+    return 'account:profile:data:%d' % profile_id
+
+
+def get_cached_profile(profile_id):
+    return cache.get(_profile_key(profile_id))
+
+
+def set_cached_profile(profile_id, data):
+    cache.set(_profile_key(profile_id), data, Configurations.PROFILE_CACHE_TIMEOUT)
+
+
+def forget_profile(profile_id):
+    cache.delete(_profile_key(profile_id))
+
+
+def forget_saved_profile(sender, instance, **kwargs):
+    forget_profile(instance.pk)
+
+
+def forget_saved_user(sender, instance, created, **kwargs):
+    profile_id = get_profile_id(instance) if not created else None
+    if profile_id is not None:
+        forget_profile(profile_id)
+
+
+def add_stats(profile_id, **counts):
+    UserProfile.objects.filter(pk=profile_id).update(**{field: F(field) + delta for field, delta in counts.items()})
+    forget_profile(profile_id)
+
+
+def compute_stats(profile_ids):
+    """
+    Returns the counts of every profile, recounted in a single query
+    """
+
+    profile_table = UserProfile._meta.db_table
+    counts = {field: RawSQL('SELECT COUNT(*) FROM %s WHERE %s.author_id = %s.id' % (
+        model._meta.db_table, model._meta.db_table, profile_table), [])
+        for field, model in counted_models.items()}
+    rows = UserProfile.objects.filter(pk__in=profile_ids).annotate(**{'recounted_' + field: count
+                                                                      for field, count in counts.items()}) \
+        .values_list('id', *['recounted_' + field for field in counted_models])
+    return {row[0]: dict(zip(counted_models, row[1:])) for row in rows}
+
+
+def repair_stats(profile_ids):
+    """
+    Writes the recounted stats of the profiles whose stored counts differ and returns how many were repaired
+    """
+
+    stored = {row[0]: dict(zip(counted_models, row[1:])) for row in
+              UserProfile.objects.filter(pk__in=profile_ids).values_list('id', *counted_models)}
+    repaired = 0
+    for profile_id, counts in compute_stats(profile_ids).items():
+        if counts != stored[profile_id]:
+            UserProfile.objects.filter(pk=profile_id).update(**counts)
+            forget_profile(profile_id)
+            repaired += 1
+    return repaired
@@ -1,3 +1,298 @@
+import io
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from account import activity, graph, stats, tokens
+from account.models import UserProfile, UserToken
+from item.models import Item, Comment, Photo, Rating
+from project_hermes.hermes_config import Configurations
+
+
+class TokenRevocationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tokens.local_cache.clear()
+        self.user = User.objects.create(username='user', email='user@example.com', password='secret')
+        self.token = UserToken.objects.create(user=self.user)
+
+    def get_active_token(self, token=None):
+        token = (token or self.token).token.hex
+        return tokens.get_active_token(token, tokens.get_versions(token))
+
+    def get_user(self, user=None):
+        user_id = (user or self.user).pk
+        return tokens.get_user(user_id, tokens.get_versions(self.token.token.hex))
+
+    def test_expired_token_is_not_served_from_the_caches(self):
+        self.assertIsNotNone(self.get_active_token())
+        tokens.expire_tokens(UserToken.objects.filter(pk=self.token.pk))
+        self.assertIsNone(self.get_active_token())
+
+    def test_saved_token_is_not_served_from_the_caches(self):
+        self.assertIsNotNone(self.get_active_token())
+        self.token.has_expired = True
+        self.token.save()
+        self.assertIsNone(self.get_active_token())
+
+    def test_touch_does_not_overwrite_a_revocation(self):
+        UserToken.objects.filter(pk=self.token.pk).update(last_accessed=timezone.now() - timedelta(hours=1))
+        versions = tokens.get_versions(self.token.token.hex)
+        version = versions[tokens._version_key('token', self.token.token.hex)]
+        tokens._get_values(tokens._token_key(version, self.token.token.hex),
+                           UserToken.objects.filter(pk=self.token.pk), tokens.TOKEN_FIELDS)
+        tokens.expire_tokens(UserToken.objects.filter(pk=self.token.pk))
+
+        # A request which read the token before it expired writes it back with its new last_accessed
+        self.assertIsNotNone(tokens.get_active_token(self.token.token.hex, versions))
+        self.assertIsNone(self.get_active_token())
+
+    def test_version_survives_eviction(self):
+        key = tokens._version_key('token', self.token.token.hex)
+        version = tokens.get_versions(self.token.token.hex)[key]
+        cache.delete(key)
+        tokens.invalidate_tokens([self.token.token.hex])
+        self.assertNotEqual(tokens.get_versions(self.token.token.hex)[key], version)
+
+    def test_versions_are_read_in_one_round_trip(self):
+        def authenticate():
+            versions = tokens.get_versions(self.token.token.hex)
+            user_token = tokens.get_active_token(self.token.token.hex, versions)
+            return tokens.get_user(user_token.user_id, versions)
+
+        authenticate()
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many, self.assertNumQueries(0):
+            self.assertEqual(authenticate().pk, self.user.pk)
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(len(get_many.call_args[0][0]), 2)
+
+    def test_revocation_keeps_the_other_entries(self):
+        other_user = User.objects.create(username='other', email='other@example.com')
+        other_token = UserToken.objects.create(user=other_user)
+        self.get_active_token(other_token)
+        self.get_user(other_user)
+        self.get_active_token()
+
+        tokens.expire_tokens(UserToken.objects.filter(pk=self.token.pk))
+        self.assertIsNone(self.get_active_token())
+
+        # Served from the caches, without a query
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.get_active_token(other_token))
+            self.assertIsNotNone(self.get_user(other_user))
+
+    def test_cached_user_holds_no_credentials(self):
+        versions = {}
+        tokens.get_user(self.user.pk, versions)
+        version = versions[tokens._version_key('user', self.user.pk)]
+        self.assertEqual(cache.get(tokens._user_key(version, self.user.pk)), (self.user.pk, 'user', True))
+
+        user = self.get_user()
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertEqual(user.email, 'user@example.com')
+
+    def test_saved_user_is_not_served_from_the_caches(self):
+        self.get_user()
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.get_user().is_active)
+
+
+class PurgeExpiredTokensTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        tokens.local_cache.clear()
+        self.user = User.objects.create(username='user', email='user@example.com', password='secret')
+
+    def create_tokens(self, count, has_expired=False):
+        return [UserToken.objects.create(user=self.user, has_expired=has_expired) for _ in range(count)]
+
+    def test_stale_tokens_are_expired_and_expired_tokens_deleted(self):
+        active = self.create_tokens(2)
+        stale = self.create_tokens(3)
+        # Cached while it was in use
+        self.assertIsNotNone(tokens.get_active_token(stale[0].token.hex, {}))
+        UserToken.objects.filter(pk__in=[token.pk for token in stale]) \
+            .update(last_accessed=timezone.now() - timedelta(days=Configurations.TOKEN_EXPIRY_DAYS + 1))
+        self.create_tokens(4, has_expired=True)
+
+        out = io.StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_expired_tokens', batch_size=2, stdout=out)
+
+        self.assertTrue(out.getvalue().startswith('Expired 3 tokens, deleted 7 in '))
+        self.assertEqual(sorted(UserToken.objects.values_list('pk', flat=True)), [token.pk for token in active])
+        self.assertIsNone(tokens.get_active_token(stale[0].token.hex, {}))
+        # Deleted in batches of one statement, without loading the tokens
+        deletes = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('DELETE')]
+        self.assertEqual(len(deletes), 4)
+
+
+class LoginTest(TestCase):
+
+    fb_user = {'id': '1234', 'first_name': 'First', 'last_name': 'Last', 'email': 'first@example.com',
+               'picture': {'data': {'url': 'https://example.com/picture.jpg'}}}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, status_code=200, body=None, error=None, access_token='access-token'):
+        response = mock.Mock(status_code=status_code, text='')
+        response.json.return_value = self.fb_user if body is None else body
+        session = mock.Mock()
+        session.get.return_value = response
+        session.get.side_effect = error
+        with mock.patch.object(graph, 'get_session', return_value=session):
+            return self.client.post('/api/account/login/', {'access_token': access_token}, format='json'), session
+
+    def test_invalid_token(self):
+        response, session = self.login(400, {'error': {'message': 'Invalid OAuth access token.'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.exists())
+
+    def test_facebook_unavailable(self):
+        response, session = self.login(error=requests.Timeout())
+        self.assertEqual(response.status_code, 503)
+        response, session = self.login(502, {'error': {'message': 'Bad gateway'}})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.exists())
+
+    def test_login_creates_the_user_once(self):
+        response, session = self.login()
+        self.assertEqual(response.status_code, 200)
+        user = User.objects.get(username='1234')
+        self.assertEqual(response.data['uid'], user.pk)
+        self.assertEqual((user.first_name, user.last_name, user.email), ('First', 'Last', 'first@example.com'))
+        self.assertEqual(UserProfile.objects.get(user=user).picture, 'https://example.com/picture.jpg')
+        self.assertEqual(UserToken.objects.get(user=user).token.hex, response.data['token'])
+
+        # Answered from the cache of the Graph API
+        response, session = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(session.get.called)
+
+        response, session = self.login(body=dict(self.fb_user, first_name='Changed'), access_token='other-token')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.count(), 1)
+        self.assertEqual(UserToken.objects.filter(user=user).count(), 3)
+        self.assertEqual(User.objects.get(pk=user.pk).first_name, 'Changed')
+
+        authenticated = APIClient()
+        authenticated.credentials(HTTP_TOKEN_AUTH=response.data['token'])
+        self.assertEqual(authenticated.get('/api/account/get_profile/').status_code, 200)
+
+
+class ProfileStatsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='author', email='author@example.com')
+        self.profile = UserProfile.objects.create(user=user)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def get_counts(self):
+        result = self.get_profile()
+        return result['items'], result['comments'], result['ratings'], result['photos']
+
+    def get_profile(self):
+        # A fresh user for every request, like the authentication gives
+        self.client.force_authenticate(User.objects.get(pk=self.profile.user_id))
+        return self.client.get('/api/account/get_profile/').data['result']
+
+    def test_write_paths_keep_the_counts(self):
+        self.assertEqual(self.get_counts(), (0, 0, 0, 0))
+
+        response = self.client.post('/api/item/', {'title': 'Item', 'description': '', 'latitude': 12.97,
+                                                   'longitude': 77.59, 'is_anonymous': False, 'male': True,
+                                                   'female': True, 'is_free': True}, format='json')
+        item_id = response.data['id']
+        self.assertEqual(self.get_counts(), (1, 0, 0, 0))
+
+        self.client.post('/api/item/%d/add_comment/' % item_id, {'description': 'Comment'}, format='json')
+        self.client.post('/api/item/%d/add_comment/' % item_id, {'description': 'Edited'}, format='json')
+        self.client.post('/api/item/%d/add_rating/' % item_id, {'rating': 4}, format='json')
+        self.client.post('/api/item/%d/add_rating/' % item_id, {'rating': 2}, format='json')
+        self.assertEqual(self.get_counts(), (1, 1, 1, 0))
+
+        self.client.delete('/api/comment/%d/' % Comment.objects.get(item_id=item_id).pk)
+        self.assertEqual(self.get_counts(), (1, 0, 1, 0))
+        self.assertEqual(stats.compute_stats([self.profile.pk])[self.profile.pk],
+                         {'items_count': 1, 'comments_count': 0, 'ratings_count': 1, 'photos_count': 0})
+
+    def test_profile_is_cached_until_it_changes(self):
+        self.get_profile()
+        with self.assertNumQueries(0):
+            self.client.get('/api/account/get_profile/')
+
+        User.objects.filter(pk=self.profile.user_id).update(first_name='Changed')
+        self.assertEqual(self.get_profile()['first_name'], '')
+        User.objects.get(pk=self.profile.user_id).save()
+        self.assertEqual(self.get_profile()['first_name'], 'Changed')
+
+        stats.add_stats(self.profile.pk, photos_count=1)
+        self.assertEqual(self.get_counts(), (0, 0, 0, 1))
+
+    def test_repair_fixes_corrupted_counts(self):
+        item = Item.objects.create(title='Item', author=self.profile, latitude=12.97, longitude=77.59)
+        Rating.objects.create(item=item, author=self.profile, rating=4)
+        self.get_counts()
+        UserProfile.objects.filter(pk=self.profile.pk).update(items_count=7, ratings_count=-1)
+
+        call_command('repair_profile_stats', stdout=io.StringIO())
+        self.assertEqual(self.get_counts(), (1, 0, 1, 0))
+
+
+class ActivityTest(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='author', email='author@example.com')
+        self.profile = UserProfile.objects.create(user=user)
+        other = UserProfile.objects.create(user=User.objects.create(username='other', email='other@example.com'))
+
+        items = [Item.objects.create(title='Item %d' % index, author=self.profile if index % 2 else other,
+                                     latitude=12.97, longitude=77.59) for index in range(4)]
+        for item in items:
+            Comment.objects.create(item=item, author=self.profile, description='')
+            Photo.objects.create(item=item, author=self.profile, picture='photo.jpg')
+            Rating.objects.create(item=item, author=self.profile, rating=4)
+
+        # Every entry shares one of two timestamps, so the order falls to the kind and the id
+        timestamps = [timezone.now() - timedelta(days=1), timezone.now()]
+        for model in [Item, Comment, Photo, Rating]:
+            for index, entry_id in enumerate(model.objects.order_by('id').values_list('id', flat=True)):
+                model.objects.filter(pk=entry_id).update(timestamp=timestamps[index % 2])
+
+    def get_pages(self, limit):
+        entries, cursor = activity.get_activity(self.profile.pk, None, limit)
+        pages = [entries]
+        while cursor is not None:
+            entries, cursor = activity.get_activity(self.profile.pk, activity.decode_cursor(cursor), limit)
+            pages.append(entries)
+        return pages
+
+    def test_pages_follow_the_feed_order(self):
+        pages = self.get_pages(1)
+        keys = [entry['key'] for page in pages for entry in page]
+        self.assertEqual(len(keys), 2 + 3 * 4)
+        self.assertEqual(len(set(keys)), len(keys))
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        self.assertEqual({entry['type'] for page in pages for entry in page}, set(activity.KINDS))
 
-# Create your tests here.
+    def test_page_size_does_not_change_the_feed(self):
+        feed = [entry['key'] for page in self.get_pages(100) for entry in page]
+        for limit in [1, 2, 3, 5]:
+            self.assertEqual([entry['key'] for page in self.get_pages(limit) for entry in page], feed)
@@ -1,5 +1,5 @@
 from rest_framework import authentication, exceptions
-from .models import UserToken
+from . import tokens
 import uuid
 
 
@@ -11,15 +11,14 @@ class TokenAuthentication(authentication.BaseAuthentication):
             return None
         else:
             try:
-                uuid_token = uuid.UUID(token)
-                user_token = UserToken.objects.all().filter(token=uuid_token)
-                if user_token.exists():
-                    user_token = user_token[0]
-                    if user_token.is_active():
-                        user = user_token.user
+                token = uuid.UUID(token).hex
+                versions = tokens.get_versions(token)
+                user_token = tokens.get_active_token(token, versions)
+                if user_token:
+                    user = tokens.get_user(user_token.user_id, versions)
+                    if user is not None:
+                        user_token.user = user
                         return user, user_token
-                    else:
-                        pass
             except ValueError:
                 pass
             raise exceptions.AuthenticationFailed('Invalid token')
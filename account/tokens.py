@@ -0,0 +1,243 @@
+"""
+Cached lookups of authentication tokens.
+
+Tokens and their users are cached in two tiers: a small LRU cache in every process, for
+`TOKEN_LOCAL_CACHE_TIMEOUT` seconds, and the shared Django cache, for `TOKEN_CACHE_TIMEOUT` seconds. Both hold the
+field values of the rows, only the columns authentication needs for the users, and fresh instances are built for
+every request.
+
+`last_accessed` is only written once it is `TOKEN_TOUCH_INTERVAL` seconds old, so a token in use costs one write
+per interval rather than one per request.
+
+Every key holds a version of its token or user, kept in the shared cache. Expiring, revoking or changing a token
+or a user moves that token or user alone to a new version once the database is written, so every process stops
+reading the entries cached before it, and a value read from the database earlier can only be written under the old
+version. A request reads the versions of its token and of its user in one round trip to the shared cache, once the
+process has seen the token and knows its user.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from django.db.models.query_utils import deferred_class_factory
+from django.utils import timezone
+
+from account.models import UserToken
+from project_hermes.hermes_config import Configurations
+
+
+class LocalCache:
+    """
+    Thread safe, size bounded LRU cache of the process whose entries expire after `timeout` seconds
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache(Configurations.TOKEN_LOCAL_CACHE_SIZE, Configurations.TOKEN_LOCAL_CACHE_TIMEOUT)
+
+TOKEN_FIELDS = [field.attname for field in UserToken._meta.concrete_fields]
+USER_FIELDS = ['id', 'username', 'is_active']
+
+# Users are built with the other columns deferred, they are loaded from the database if a view reads them
+CachedUser = deferred_class_factory(User, [field.attname for field in User._meta.concrete_fields
+                                           if field.attname not in USER_FIELDS])
+
+
+def _version_key(kind, key):
+    return 'account:%s:version:%s' % (kind, key)
+
+
+def _owner_key(token):
+    # The user of a token never changes, so the process remembers it to read both versions at once
+    return 'account:token:user:%s' % token
+
+
+def _get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            # Starts at random, so that the versions are not used again once the shared cache evicts them
+            cache.add(key, random.getrandbits(48), Configurations.TOKEN_CACHE_TIMEOUT)
+        versions.update(cache.get_many(missing))
+    # None when the shared cache is unavailable
+    return {key: versions.get(key) for key in keys}
+
+
+def _get_version(versions, key):
+    if key not in versions:
+        versions.update(_get_versions([key]))
+    return versions[key]
+
+
+def get_versions(token):
+    """
+    Returns the versions of the token with the given hex and of its user, which are passed on to `get_active_token`
+    and `get_user`. The version of the user is only read with the token once the process knows its user.
+    """
+
+    keys = [_version_key('token', token)]
+    user_id = local_cache.get(_owner_key(token))
+    if user_id is not None:
+        keys.append(_version_key('user', user_id))
+    return _get_versions(keys)
+
+
+def _invalidate(keys):
+    # A new random version rather than the next one, so that an evicted version is not used again either
+    cache.set_many({key: random.getrandbits(48) for key in keys}, Configurations.TOKEN_CACHE_TIMEOUT)
+
+
+def invalidate_tokens(tokens):
+    """
+    Moves the tokens with the given hexes to new versions, dropping them from the caches of every process
+    """
+
+    _invalidate([_version_key('token', token) for token in tokens])
+
+
+def invalidate_user(user_id):
+    """
+    Moves the user to a new version, dropping it from the caches of every process
+    """
+
+    _invalidate([_version_key('user', user_id)])
+
+
+def _token_key(version, token):
+    return 'account:token:%d:%s' % (version, token)
+
+
+def _user_key(version, user_id):
+    return 'account:user:%d:%d' % (version, user_id)
+
+
+def _get_values(key, queryset, fields):
+    if key is None:
+        # The shared cache is unavailable, so revocations could not be seen
+        return queryset.values_list(*fields).first()
+
+    values = local_cache.get(key)
+    if values is None:
+        values = cache.get(key)
+        if values is None:
+            values = queryset.values_list(*fields).first()
+            if values is None:
+                return None
+            cache.set(key, values, Configurations.TOKEN_CACHE_TIMEOUT)
+        local_cache.set(key, values)
+    return values
+
+
+def _set_values(key, values):
+    if key is not None:
+        cache.set(key, values, Configurations.TOKEN_CACHE_TIMEOUT)
+        local_cache.set(key, values)
+
+
+def _build(model, fields, values):
+    return model.from_db(router.db_for_read(model), fields, values)
+
+
+def expire_tokens(queryset):
+    """
+    Expires the tokens of the queryset and drops them from the caches
+    """
+
+    expiring = list(queryset.filter(has_expired=False).values_list('pk', 'token'))
+    count = UserToken.objects.filter(pk__in=[pk for pk, token in expiring], has_expired=False) \
+        .update(has_expired=True)
+    if count:
+        invalidate_tokens([token.hex for pk, token in expiring])
+    return count
+
+
+def get_active_token(token, versions):
+    """
+    Returns the token with the given hex if it is active, setting its `last_accessed` at most once per interval,
+    None otherwise
+    """
+
+    version = _get_version(versions, _version_key('token', token))
+    key = _token_key(version, token) if version is not None else None
+    values = _get_values(key, UserToken.objects.filter(token=token), TOKEN_FIELDS)
+    if values is None:
+        return None
+
+    user_token = _build(UserToken, TOKEN_FIELDS, values)
+    local_cache.set(_owner_key(token), user_token.user_id)
+    if user_token.has_expired:
+        return None
+
+    now = timezone.now()
+    if now - user_token.last_accessed > timedelta(days=Configurations.TOKEN_EXPIRY_DAYS):
+        expire_tokens(UserToken.objects.filter(pk=user_token.pk))
+        return None
+
+    if now - user_token.last_accessed > timedelta(seconds=Configurations.TOKEN_TOUCH_INTERVAL):
+        UserToken.objects.filter(pk=user_token.pk).update(last_accessed=now)
+        user_token.last_accessed = now
+        # Written under the version read before the token, a revocation since then is not overwritten
+        _set_values(key, tuple(getattr(user_token, field) for field in TOKEN_FIELDS))
+    return user_token
+
+
+def get_user(user_id, versions):
+    version = _get_version(versions, _version_key('user', user_id))
+    key = _user_key(version, user_id) if version is not None else None
+    values = _get_values(key, User.objects.filter(pk=user_id), USER_FIELDS)
+    return _build(CachedUser, USER_FIELDS, values) if values is not None else None
+
+
+def forget_saved_token(sender, instance, created=False, **kwargs):
+    # A new token has not been cached yet
+    if not created:
+        invalidate_tokens([instance.token.hex])
+
+
+def forget_deleted_token(sender, instance, **kwargs):
+    # Expired tokens were dropped when they expired
+    if not instance.has_expired:
+        invalidate_tokens([instance.token.hex])
+
+
+def forget_saved_user(sender, instance, created=False, **kwargs):
+    if not created:
+        invalidate_user(instance.pk)
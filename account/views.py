@@ -1,14 +1,18 @@
 # Create your views here.
-import facebook
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404
 from rest_framework import viewsets
 from rest_framework.decorators import list_route, detail_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST
+from rest_framework.settings import api_settings
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_503_SERVICE_UNAVAILABLE
 
 from account.models import UserProfile
 from account.models import UserToken
+from account import activity, graph, profiles, stats
 from account.serializers import UserProfileSerializer, LoginSerializer, UserDetailsProfileSerializer, \
     UserActivitySerializer
 
@@ -18,13 +22,34 @@ class AccountViewSet(viewsets.GenericViewSet):
 
     @list_route(methods=['GET'], permission_classes=[IsAuthenticated])
     def get_profile(self, request):
-        profile = UserProfile.objects.filter(user=request.user).first()
-        return Response({'result': UserDetailsProfileSerializer(profile).data})
+        profile_id = profiles.get_profile_id(request.user)
+        data = stats.get_cached_profile(profile_id) if profile_id is not None else None
+        if data is None:
+            profile = profiles.get_profile(request.user)
+            if profile is None:
+                raise Http404
+            data = UserDetailsProfileSerializer(profile).data
+            if profile_id is not None:
+                stats.set_cached_profile(profile_id, dict(data))
+        return Response({'result': data})
 
     @list_route(methods=['GET'], permission_classes=[IsAuthenticated])
     def get_activity(self, request):
-        profile = UserProfile.objects.filter(user=request.user).first()
-        return Response({'result': UserActivitySerializer(profile).data})
+        try:
+            cursor = activity.decode_cursor(request.query_params['cursor']) \
+                if 'cursor' in request.query_params else None
+            limit = min(max(int(request.query_params.get('page_size', api_settings.PAGE_SIZE)), 1),
+                        activity.MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'success': False, 'message': 'Incorrect Data Sent'}, status=HTTP_400_BAD_REQUEST)
+
+        profile = profiles.get_profile(request.user)
+        if profile is None:
+            raise Http404
+        entries, next_cursor = activity.get_activity(profile.pk, cursor, limit)
+        result = UserProfileSerializer(profile).data
+        result['activity'] = UserActivitySerializer(entries, many=True).data
+        return Response({'result': result, 'next': next_cursor})
 
     @list_route(methods=['POST'])
     def login(self, request):
@@ -37,37 +62,41 @@ class AccountViewSet(viewsets.GenericViewSet):
         if serialized_data.is_valid():
             access_token = serialized_data.validated_data['access_token']
 
-            graph = facebook.GraphAPI(access_token=access_token, version='2.5')
-
             try:
-                fb_user = graph.get_object('me?fields=id,first_name,last_name,picture.height(256),email')
-            except facebook.GraphAPIError:
+                fb_user = graph.get_user(access_token)
+            except graph.GraphAPIError:
                 return Response({'success': False, 'message': 'Invalid token'}, status=HTTP_400_BAD_REQUEST)
+            except graph.GraphUnavailable:
+                return Response({'success': False, 'message': 'Facebook is unavailable'},
+                                status=HTTP_503_SERVICE_UNAVAILABLE)
 
-            user, created = User.objects.get_or_create(username=fb_user['id'])
-            user_profile, profile_created = UserProfile.objects.get_or_create(user=user)
-
-            if created:
-                user.set_unusable_password()
-
-            user.first_name = fb_user['first_name']
-            user.last_name = fb_user['last_name']
-
-            if 'picture' in fb_user:
-                user_profile.picture = fb_user['picture']['data']['url']
-
+            details = {'first_name': fb_user['first_name'], 'last_name': fb_user['last_name']}
             if 'email' in fb_user:
-                user.email = fb_user['email']
-
-            user.save()
-            user_profile.save()
+                details['email'] = fb_user['email']
+
+            with transaction.atomic():
+                user, created = User.objects.get_or_create(username=fb_user['id'],
+                                                           defaults=dict(details, password=make_password(None)))
+                changed = [field for field, value in details.items() if getattr(user, field) != value]
+                if changed:
+                    for field in changed:
+                        setattr(user, field, details[field])
+                    user.save(update_fields=changed)
+
+                picture = fb_user['picture']['data']['url'] if 'picture' in fb_user else None
+                user_profile = UserProfile.objects.filter(user=user).values_list('id', 'picture').first()
+                if user_profile is None:
+                    UserProfile.objects.create(user=user, picture=picture or '')
+                elif picture is not None and user_profile[1] != picture:
+                    UserProfile.objects.filter(pk=user_profile[0]).update(**UserProfile.changed(picture=picture))
+
+                user_token = UserToken.objects.create(user=user)
 
-            user_token = UserToken.objects.create(user=user)
             return Response(
                     {
                         'success': True,
                         'token': user_token.token.hex,
-                        'uid': User.objects.get(email=user.email).pk,
+                        'uid': user.pk,
                     }
             )
 
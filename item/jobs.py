@@ -0,0 +1,131 @@
+"""
+Background recomputes of derived values.
+
+Requests only make their primary write and `enqueue` the recomputes it calls for, which are stored in the
+`RecomputeJob` table with one row per object, so a burst of votes on a comment is recomputed once. The
+`run_recompute_jobs` command leases the pending jobs in batches, runs them on a pool of threads and deletes them
+once they succeed. A job whose worker failed or died is run again once its lease of `RECOMPUTE_LEASE_TIMEOUT`
+seconds expires.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from account.stats import repair_stats
+from item.models import Item, Comment, Photo, RecomputeJob, RecomputeJobKinds
+from item.reputation import add_reputation, reconcile_reputations
+from project_hermes.hermes_config import Configurations
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, *object_ids):
+    for object_id in object_ids:
+        try:
+            with transaction.atomic():
+                RecomputeJob.objects.create(kind=kind, object_id=object_id)
+        except IntegrityError:
+            # Already pending, or leased by a worker which may have read the object before this change, in which
+            # case it is released so that the worker does not delete it and it runs again
+            RecomputeJob.objects.filter(kind=kind, object_id=object_id, claimed_at__isnull=False) \
+                .update(claimed_at=None)
+
+
+def claim_jobs(limit):
+    """
+    Leases up to `limit` of the oldest pending jobs, a job is claimed by the worker whose update set its
+    `claimed_at`
+    """
+
+    expired = timezone.now() - timedelta(seconds=Configurations.RECOMPUTE_LEASE_TIMEOUT)
+    jobs = list(RecomputeJob.objects.filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=expired)).order_by('id')
+                [:limit])
+
+    claimed = []
+    for job in jobs:
+        claimed_at = timezone.now()
+        if RecomputeJob.objects.filter(pk=job.pk, claimed_at=job.claimed_at).update(claimed_at=claimed_at):
+            job.claimed_at = claimed_at
+            claimed.append(job)
+    return claimed
+
+
+def finish_jobs(jobs):
+    """
+    Deletes the jobs which are still leased by this worker, the others were enqueued again while they ran
+    """
+
+    for job in jobs:
+        RecomputeJob.objects.filter(pk=job.pk, claimed_at=job.claimed_at).delete()
+
+
+def recompute_reactable(reactable_id):
+    with transaction.atomic():
+        reactable = Comment.objects.select_for_update().filter(pk=reactable_id).first() or \
+            Photo.objects.select_for_update().filter(pk=reactable_id).first()
+        if reactable is None:
+            return
+        # The vote counters are kept by the requests, only the score follows them here
+        add_reputation(reactable.author_id, reactable.recalculate_score())
+        reactable.save(update_fields=['experience'])
+    reactable.item.touch()
+
+
+def recompute_item(item_id):
+    with transaction.atomic():
+        item = Item.objects.select_for_update().filter(pk=item_id).first()
+        if item is None:
+            return
+        rating, status = item.rating, item.status
+        item.update_rating()
+        if (item.rating, item.status) != (rating, status):
+            item.save(update_fields=['rating', 'status', 'version', 'updated_at'])
+
+
+def run_jobs(kind, jobs):
+    object_ids = [job.object_id for job in jobs]
+    try:
+        if kind == RecomputeJobKinds.REACTABLE:
+            for object_id in object_ids:
+                recompute_reactable(object_id)
+        elif kind == RecomputeJobKinds.ITEM:
+            for object_id in object_ids:
+                recompute_item(object_id)
+        elif kind == RecomputeJobKinds.REPUTATION:
+            reconcile_reputations(object_ids)
+        elif kind == RecomputeJobKinds.PROFILE_STATS:
+            repair_stats(object_ids)
+        finish_jobs(jobs)
+    except Exception:
+        logger.exception('Recompute of %s %r failed, run again once its lease expires', kind, object_ids)
+        raise
+    finally:
+        # Worker threads open a connection of their own
+        connection.close()
+
+
+def run_pending(pool, workers, batch_size):
+    """
+    Runs a batch of claimed jobs on the `pool` executor of `workers` threads, split by kind, and returns how many
+    were claimed
+    """
+
+    jobs = claim_jobs(batch_size)
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+
+    futures = []
+    for kind, kind_jobs in by_kind.items():
+        size = -(-len(kind_jobs) // workers)
+        for start in range(0, len(kind_jobs), size):
+            futures.append(pool.submit(run_jobs, kind, kind_jobs[start:start + size]))
+
+    for future in futures:
+        future.exception()
+    return len(jobs)
@@ -0,0 +1,186 @@
+import io
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.utils import CursorDebugWrapper
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from account import graph, tokens
+from item.models import Item, Comment, Photo, nearest_index
+
+# The endpoints write the tile versions, the cached profiles and the other cached values, which a rolled back
+# transaction does not undo, so they are captured against a cache of their own
+CAPTURE_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'explain_queries',
+    }
+}
+
+# Answered from the cache of the Graph API, so that the login makes its queries without calling Facebook
+LOGIN_ACCESS_TOKEN = 'explain_queries'
+
+
+def create_image(name):
+    picture = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(picture, 'PNG')
+    return SimpleUploadedFile(name, picture.getvalue(), content_type='image/png')
+
+
+class RecordingCursor(CursorDebugWrapper):
+    def __init__(self, cursor, db, statements):
+        super().__init__(cursor, db)
+        self.statements = statements
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        return super().execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.statements.append((sql, None))
+        return super().executemany(sql, param_list)
+
+
+class Command(BaseCommand):
+    help = 'Runs every endpoint inside a rolled back transaction, against a cache of its own, and prints the plan ' \
+           'of each query it makes, flagging the full table scans'
+
+    explained = ('SELECT', 'UPDATE', 'DELETE')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to make the authenticated requests as, the first user otherwise')
+        parser.add_argument('--endpoint', action='append', default=[],
+                            help='Only explain the endpoints with this name, may be repeated')
+
+    def get_endpoints(self, item, own_item, comment_item, comment, photo):
+        box = {'min_latitude': item.latitude - 0.05, 'max_latitude': item.latitude + 0.05,
+               'min_longitude': item.longitude - 0.05, 'max_longitude': item.longitude + 0.05}
+        endpoints = [
+            ('item-list', 'get', '/api/item/', None),
+            ('item-list-markers', 'get', '/api/item/?format=markers', None),
+            ('item-list-markers-binary', 'get', '/api/item/?format=markers-binary', None),
+            ('item-detail', 'get', '/api/item/%d/' % item.pk, None),
+            ('search_bounding_box', 'post', '/api/item/search_bounding_box/', box),
+            ('search_bounding_box-stream', 'post', '/api/item/search_bounding_box/', dict(box, stream=True)),
+            ('search_bounding_box-limit', 'post', '/api/item/search_bounding_box/', dict(box, limit=50)),
+            ('search_bounding_box-markers', 'post', '/api/item/search_bounding_box/?format=markers', box),
+            ('search_bounding_box-clusters', 'post', '/api/item/search_bounding_box/', dict(box, zoom=10)),
+            ('changes_since', 'post', '/api/item/changes_since/', dict(box, since='2000-01-01T00:00:00Z')),
+            ('nearest', 'post', '/api/item/nearest/', {'latitude': item.latitude, 'longitude': item.longitude}),
+            ('get_user_comment', 'get', '/api/item/%d/get_user_comment/' % item.pk, None),
+            ('get_comments', 'get', '/api/item/%d/get_comments/' % item.pk, None),
+            ('get_stars', 'get', '/api/item/%d/get_stars/' % item.pk, None),
+            ('get_photos', 'get', '/api/item/%d/get_photos/' % item.pk, None),
+            ('create', 'post', '/api/item/', {'title': 'Explain', 'description': '', 'latitude': item.latitude,
+                                              'longitude': item.longitude, 'is_anonymous': False, 'male': True,
+                                              'female': True, 'is_free': True}),
+            ('add_rating', 'post', '/api/item/%d/add_rating/' % item.pk, {'rating': 4}),
+            ('add_flag', 'post', '/api/item/%d/add_flag/' % item.pk, None),
+            ('add_comment', 'post', '/api/item/%d/add_comment/' % item.pk, {'description': 'Explain'}),
+            ('add_photo', 'post', '/api/item/%d/add_photo/' % item.pk, {'picture': create_image('add_photo.png')}),
+            ('login', 'post', '/api/account/login/', {'access_token': LOGIN_ACCESS_TOKEN}),
+            ('get_profile', 'get', '/api/account/get_profile/', None),
+            ('get_activity', 'get', '/api/account/get_activity/', None),
+        ]
+        # Only the author may change an item
+        if own_item is not None:
+            endpoints.append(('update', 'put', '/api/item/%d/' % own_item.pk,
+                              {'title': 'Explain', 'description': '', 'is_anonymous': False, 'male': True,
+                               'female': False, 'is_free': True}))
+            endpoints.append(('destroy', 'delete', '/api/item/%d/' % own_item.pk, None))
+        # An author has one comment per item
+        if comment_item is not None:
+            endpoints.append(('comment-create', 'post', '/api/comment/',
+                              {'item': comment_item.pk, 'description': 'Explain'}))
+        endpoints.append(('photo-create', 'post', '/api/photo/',
+                          {'item': item.pk, 'picture': create_image('photo-create.png')}))
+        for name, reactable in [('comment', comment), ('photo', photo)]:
+            if reactable is None:
+                continue
+            endpoints.append(('%s-list' % name, 'get', '/api/%s/' % name, None))
+            endpoints.append(('%s-update' % name, 'patch', '/api/%s/%d/' % (name, reactable.pk),
+                              {'is_anonymous': True}))
+            for action in ['upvote', 'downvote', 'unvote', 'flag', 'unflag']:
+                endpoints.append(('%s-%s' % (name, action), 'post', '/api/%s/%d/%s/' % (name, reactable.pk, action),
+                                  None))
+            endpoints.append(('%s-destroy' % name, 'delete', '/api/%s/%d/' % (name, reactable.pk), None))
+        return endpoints
+
+    def explain(self, sql, params):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+        if connection.vendor == 'sqlite':
+            return [row[-1] for row in rows]
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def is_full_scan(line):
+        if connection.vendor == 'sqlite':
+            return line.startswith('SCAN') and 'USING' not in line
+        return 'Seq Scan' in line
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first() if options['user'] else \
+            User.objects.order_by('id').first()
+        item = Item.objects.order_by('id').first()
+        if user is None or item is None:
+            raise CommandError('Needs at least one user and one item')
+
+        client = APIClient()
+        endpoints = self.get_endpoints(item, Item.objects.filter(author__user=user).order_by('id').first(),
+                                       Item.objects.exclude(comments__author__user=user).order_by('id').first(),
+                                       Comment.objects.order_by('id').first(), Photo.objects.order_by('id').first())
+        fb_user = {'id': user.username, 'first_name': user.first_name, 'last_name': user.last_name}
+
+        scans = 0
+        # The uploaded pictures are written outside of the media of the site
+        with tempfile.TemporaryDirectory() as media_root:
+            for name, method, path, data in endpoints:
+                if options['endpoint'] and name not in options['endpoint']:
+                    continue
+
+                # A fresh user for every endpoint, so that nothing is memoized on it from a rolled back request
+                client.force_authenticate(User.objects.get(pk=user.pk))
+                data_format = 'multipart' if data and any(isinstance(value, SimpleUploadedFile)
+                                                          for value in data.values()) else 'json'
+                statements = []
+                with transaction.atomic(), override_settings(ALLOWED_HOSTS=['*'], CACHES=CAPTURE_CACHES,
+                                                             MEDIA_ROOT=media_root):
+                    cache.set(graph._token_key(LOGIN_ACCESS_TOKEN), fb_user)
+                    force_debug_cursor, connection.force_debug_cursor = connection.force_debug_cursor, True
+                    connection.make_debug_cursor = lambda cursor: RecordingCursor(cursor, connection, statements)
+                    try:
+                        response = getattr(client, method)(path, data, format=data_format)
+                        # The streamed items are queried while the response is read
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                    finally:
+                        del connection.make_debug_cursor
+                        connection.force_debug_cursor = force_debug_cursor
+
+                    self.stdout.write('%s %s %s -> %d, %d queries' % (name, method.upper(), path,
+                                                                      response.status_code, len(statements)))
+                    for sql, params in statements:
+                        if not sql.lstrip().upper().startswith(self.explained):
+                            continue
+                        self.stdout.write('  ' + sql)
+                        for line in self.explain(sql, params):
+                            if self.is_full_scan(line):
+                                scans += 1
+                            self.stdout.write('    %s%s' % ('! ' if self.is_full_scan(line) else '', line))
+                    transaction.set_rollback(True)
+                    cache.clear()
+
+                # The process state the endpoint changed is reloaded from the database on its next use
+                nearest_index.tree = None
+                tokens.local_cache.clear()
+
+        self.stdout.write('%d full table scans on %s' % (scans, connection.vendor))
@@ -0,0 +1,35 @@
+from django.core.management.base import CommandError
+
+from account.models import UserProfile
+from item.reputation import reconcile_reputations
+from project_hermes.batch_command import BatchCommand
+
+
+class Command(BatchCommand):
+    help = 'Checks the reputation of every user against a full recompute from their items, comments, photos ' \
+           'and reactions'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--tolerance', type=float, default=1e-6)
+        parser.add_argument('--repair', action='store_true', default=False,
+                            help='Write the recomputed reputation of the mismatched users')
+
+    def get_queryset(self, options):
+        return UserProfile.objects.values_list('id', flat=True)
+
+    def handle_batch(self, ids, options):
+        mismatched = 0
+        for profile_id, stored, reputation in reconcile_reputations(ids, options['repair'], options['tolerance']):
+            mismatched += 1
+            self.stdout.write('User %d: stored %r, recomputed %r' % (profile_id, stored, reputation))
+        return mismatched
+
+    def report(self, checked, mismatched, options):
+        self.stdout.write('Checked %d users, %d mismatched%s' % (checked, mismatched,
+                                                                 ', repaired' if options['repair'] else ''))
+
+    def handle(self, *args, **options):
+        super().handle(*args, **options)
+        if self.changed and not options['repair']:
+            raise CommandError('%d users have a reputation which does not match their contributions' % self.changed)
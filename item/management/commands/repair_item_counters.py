@@ -0,0 +1,45 @@
+from django.db.models import Count
+
+from item.models import Item, Rating, Comment, Photo, ItemFlags
+from project_hermes.batch_command import BatchCommand
+
+
+class Command(BatchCommand):
+    help = 'Re-derives the denormalized counters and star histogram of every item from the rows they count'
+    subject = 'items'
+
+    counted_models = {
+        'flags': ItemFlags,
+        'ratings_count': Rating,
+        'comments_count': Comment,
+        'photos_count': Photo,
+    }
+
+    def get_fields(self):
+        return list(self.counted_models) + list(Item.star_fields.values())
+
+    def get_queryset(self, options):
+        return Item.objects.only('id', 'cell', *self.get_fields())
+
+    def handle_batch(self, items, options):
+        ids = [item.id for item in items]
+        counts = {field: dict(model.objects.filter(item_id__in=ids).order_by().values_list('item_id')
+                              .annotate(count=Count('pk')))
+                  for field, model in self.counted_models.items()}
+        counts.update({field: {} for field in Item.star_fields.values()})
+        stars = Rating.objects.filter(item_id__in=ids, rating__in=list(Item.star_fields)).order_by() \
+            .values_list('item_id', 'rating').annotate(count=Count('pk'))
+        for item_id, rating, count in stars:
+            counts[Item.star_fields[rating]][item_id] = count
+
+        repaired = 0
+        for item in items:
+            changes = {}
+            for field in counts:
+                count = counts[field].get(item.id, 0)
+                if getattr(item, field) != count:
+                    changes[field] = count
+            if changes:
+                item.repair(**changes)
+                repaired += 1
+        return repaired
@@ -0,0 +1,29 @@
+from item.jobs import enqueue
+from item.models import Reactable, Reaction, RecomputeJobKinds
+from project_hermes.batch_command import BatchCommand
+
+
+class Command(BatchCommand):
+    help = 'Recounts the votes of every comment and photo from their reactions and queues the score of the ' \
+           'repaired ones'
+    subject = 'comments and photos'
+
+    def get_queryset(self, options):
+        return Reactable.objects.values('id', *Reactable.vote_fields.values())
+
+    def handle_batch(self, reactables, options):
+        ids = [reactable['id'] for reactable in reactables]
+        counts = {row['reactable_id']: row for row in
+                  Reaction.objects.filter(reactable_id__in=ids).order_by().values('reactable_id')
+                      .annotate(**Reactable.get_vote_counts())}
+
+        repaired = 0
+        for reactable in reactables:
+            count = counts.get(reactable['id'], {})
+            changes = {field: count.get(field) or 0 for field in Reactable.vote_fields.values()
+                       if reactable[field] != (count.get(field) or 0)}
+            if changes:
+                Reactable.objects.filter(pk=reactable['id']).update(**changes)
+                enqueue(RecomputeJobKinds.REACTABLE, reactable['id'])
+                repaired += 1
+        return repaired
@@ -0,0 +1,31 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from item import jobs
+from project_hermes.hermes_config import Configurations
+
+
+class Command(BaseCommand):
+    help = 'Runs the pending recomputes of votes, scores, item ratings and reputations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=Configurations.RECOMPUTE_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=Configurations.RECOMPUTE_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep polling the queue every INTERVAL seconds instead of exiting once it is empty')
+
+    def handle(self, *args, **options):
+        processed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                claimed = jobs.run_pending(pool, options['workers'], options['batch_size'])
+                processed += claimed
+                if claimed:
+                    continue
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+
+        self.stdout.write('Ran %d recompute jobs' % processed)
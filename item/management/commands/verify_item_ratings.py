@@ -0,0 +1,50 @@
+from django.db.models import F, Sum
+
+from item.models import Item, Rating
+from project_hermes.batch_command import BatchCommand
+
+
+class Command(BatchCommand):
+    help = 'Checks the running rating sums of every item, and the rating and status derived from them, against ' \
+           'a full recompute from its ratings'
+    subject = 'items'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--tolerance', type=float, default=1e-9)
+        parser.add_argument('--repair', action='store_true', default=False,
+                            help='Write the recomputed sums, rating and status of the mismatched items')
+
+    def get_queryset(self, options):
+        return Item.objects.all()
+
+    def handle_batch(self, items, options):
+        ids = [item.id for item in items]
+        totals = {row['item_id']: row for row in
+                  Rating.objects.filter(item_id__in=ids).order_by().values('item_id')
+                      .annotate(total=Sum(F('rating') * F('weight')), weight=Sum('weight'))}
+
+        mismatched = 0
+        for item in items:
+            total = totals.get(item.id, {})
+            stored = (item.rating_sum, item.rating_weight, item.rating, item.status)
+            item.rating_sum, item.rating_weight = total.get('total') or 0.0, total.get('weight') or 0.0
+            # The rating and status clients read are derived from the sums, they are checked against the
+            # recomputed sums too
+            item.update_rating()
+            recomputed = (item.rating_sum, item.rating_weight, item.rating, item.status)
+            if all(abs(value - stored_value) <= options['tolerance']
+                   for value, stored_value in zip(recomputed[:3], stored[:3])) and recomputed[3] == stored[3]:
+                continue
+
+            mismatched += 1
+            self.stdout.write('Item %d: stored sums %r / %r, rating %r, status %r, recomputed %r / %r, %r, %r' % (
+                (item.id,) + stored + recomputed))
+            if options['repair']:
+                item.repair(rating_sum=item.rating_sum, rating_weight=item.rating_weight, rating=item.rating,
+                            status=item.status)
+        return mismatched
+
+    def report(self, checked, mismatched, options):
+        self.stdout.write('Checked %d items, %d mismatched%s' % (checked, mismatched,
+                                                                 ', repaired' if options['repair'] else ''))
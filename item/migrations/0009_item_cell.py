@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from item import spatial
+
+
+def backfill_cells(apps, schema_editor):
+    Item = apps.get_model('item', 'Item')
+    for item in Item.objects.only('id', 'latitude', 'longitude').iterator():
+        Item.objects.filter(pk=item.pk).update(cell=spatial.get_cell(item.latitude, item.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0008_itemflags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='cell',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_cells, migrations.RunPython.noop),
+    ]
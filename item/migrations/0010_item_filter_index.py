@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 10:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0009_item_cell'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='cell',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together=set([('cell', 'status', 'gender', 'is_free', 'rating')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 10:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0011_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
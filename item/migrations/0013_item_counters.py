@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 10:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Item = apps.get_model('item', 'Item')
+    counted_models = {
+        'flags': apps.get_model('item', 'ItemFlags'),
+        'ratings_count': apps.get_model('item', 'Rating'),
+        'comments_count': apps.get_model('item', 'Comment'),
+        'photos_count': apps.get_model('item', 'Photo'),
+    }
+
+    Item.objects.update(flags=0)
+    for field, model in counted_models.items():
+        counts = model.objects.order_by().values_list('item_id').annotate(count=Count('pk'))
+        for item_id, count in counts.iterator():
+            Item.objects.filter(pk=item_id).update(**{field: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0012_item_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='comments_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='photos_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='ratings_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 10:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_sums(apps, schema_editor):
+    Item = apps.get_model('item', 'Item')
+    Rating = apps.get_model('item', 'Rating')
+    totals = Rating.objects.order_by().values_list('item_id').annotate(total=Sum('rating'), weight=Count('pk'))
+    for item_id, total, weight in totals.iterator():
+        Item.objects.filter(pk=item_id).update(rating_sum=total, rating_weight=weight)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0013_item_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='rating_sum',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_weight',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='weight',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.RunPython(backfill_rating_sums, migrations.RunPython.noop),
+    ]
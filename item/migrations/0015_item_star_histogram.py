@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 10:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+STAR_FIELDS = ['stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+
+
+class Migration(migrations.Migration):
+    """
+    Existing items get null histograms, which get_stars answers from the ratings until repair_item_counters
+    backfills them. New items start from zero.
+    """
+
+    dependencies = [
+        ('item', '0014_item_rating_sums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name=name,
+            field=models.IntegerField(editable=False, null=True),
+        ) for name in STAR_FIELDS
+    ] + [
+        migrations.AlterField(
+            model_name='item',
+            name=name,
+            field=models.IntegerField(default=0, editable=False, null=True),
+        ) for name in STAR_FIELDS
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0015_item_star_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecomputeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.IntegerField(choices=[(0, 'Votes and score of a comment or photo'), (1, 'Rating and status of an item'), (2, 'Reputation of a user')])),
+                ('object_id', models.IntegerField()),
+                ('timestamp', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='recomputejob',
+            unique_together=set([('kind', 'object_id')]),
+        ),
+    ]
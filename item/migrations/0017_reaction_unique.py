@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+FLAG = 3
+
+
+def remove_duplicate_reactions(apps, schema_editor):
+    """
+    Keeps the latest vote and the latest flag of every author on a reactable and recounts the reactables which had
+    duplicates
+    """
+
+    Reactable = apps.get_model('item', 'Reactable')
+    Reaction = apps.get_model('item', 'Reaction')
+
+    affected = set()
+    for reactions in [Reaction.objects.filter(reaction=FLAG), Reaction.objects.exclude(reaction=FLAG)]:
+        duplicates = reactions.order_by().values('reactable_id', 'author_id') \
+            .annotate(count=Count('pk'), latest=Max('pk')).filter(count__gt=1)
+        for row in duplicates:
+            reactions.filter(reactable_id=row['reactable_id'], author_id=row['author_id']) \
+                .exclude(pk=row['latest']).delete()
+            affected.add(row['reactable_id'])
+
+    for reactable_id in affected:
+        counts = dict(Reaction.objects.filter(reactable_id=reactable_id).order_by().values_list('reaction')
+                      .annotate(count=Count('pk')))
+        Reactable.objects.filter(pk=reactable_id).update(upvotes=counts.get(1, 0), downvotes=counts.get(2, 0),
+                                                         flags=counts.get(FLAG, 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0016_recomputejob'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_reactions, migrations.RunPython.noop),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX item_reaction_vote_uniq ON item_reaction (reactable_id, author_id) '
+             'WHERE reaction <> 3'],
+            ['DROP INDEX item_reaction_vote_uniq'],
+        ),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX item_reaction_flag_uniq ON item_reaction (reactable_id, author_id) '
+             'WHERE reaction = 3'],
+            ['DROP INDEX item_reaction_flag_uniq'],
+        ),
+    ]
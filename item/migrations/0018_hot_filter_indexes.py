@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:04
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0017_reaction_unique'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together=set([('author', 'latitude', 'longitude'), ('cell', 'status', 'gender', 'is_free', 'rating')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='itemflags',
+            index_together=set([('item', 'author')]),
+        ),
+        migrations.RunSQL(
+            ['CREATE INDEX item_item_searchable ON item_item (id, latitude, longitude) WHERE status <> 3'],
+            ['DROP INDEX item_item_searchable'],
+        ),
+    ]
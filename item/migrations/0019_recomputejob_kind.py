@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:11
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0018_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recomputejob',
+            name='kind',
+            field=models.IntegerField(choices=[(0, 'Votes and score of a comment or photo'), (1, 'Rating and status of an item'), (2, 'Reputation of a user'), (3, 'Contribution counts of a user')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-18 11:11
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+SEARCHABLE_INDEX = 'CREATE INDEX item_item_searchable ON item_item (id, latitude, longitude) WHERE status <> 3'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0019_recomputejob_kind'),
+    ]
+
+    # SQLite remakes item_item to change its index_together, which loses the partial index of 0018, so it is
+    # dropped around the change and created again after it in both directions
+    operations = [
+        migrations.RunSQL(
+            ['DROP INDEX item_item_searchable'],
+            [SEARCHABLE_INDEX],
+        ),
+        migrations.AlterIndexTogether(
+            name='item',
+            index_together=set([('cell', 'status', 'gender', 'is_free', 'rating'), ('author', 'timestamp'), ('author', 'latitude', 'longitude')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='rating',
+            index_together=set([('author', 'timestamp')]),
+        ),
+        migrations.RunSQL(
+            [SEARCHABLE_INDEX],
+            ['DROP INDEX item_item_searchable'],
+        ),
+    ]
@@ -1,8 +1,20 @@
 from __future__ import unicode_literals
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Sum, Case, When, IntegerField
+from django.utils import timezone
 
 from account.models import UserProfile
+from item import spatial, tile_cache
+from project_hermes.hermes_config import Configurations
+
+
+def count_when(**condition):
+    """
+    Aggregate counting the rows which match the condition, for several counts in a single query
+    """
+
+    return Sum(Case(When(then=1, **condition), default=0, output_field=IntegerField()))
 
 
 class ItemStatusChoices:
@@ -62,32 +74,135 @@ class Item(models.Model):
     longitude = models.FloatField()
     flags = models.IntegerField(default=0)
     timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     status = models.IntegerField(choices=ItemStatusChoices.get(), default=ItemStatusChoices.UNVERIFIED)
     is_anonymous = models.BooleanField(default=False)
     is_free = models.BooleanField(default=True)
     gender = models.IntegerField(choices=WashroomTypes.get(), default=WashroomTypes.BOTH)
-
-    def recalculate_rating(self):
-        self.rating = 0.0
-        weight = 0.0
-        for rating in self.ratings.all():
-            rating_weight = 1.0
-            # Could be a function of the user : max(0.0, rating.author.reputation)
-
-            self.rating += rating.rating * rating_weight
-            weight += rating_weight
-
-        if weight == 0.0:
+    cell = models.BigIntegerField(default=0, editable=False)
+    version = models.IntegerField(default=0, editable=False)
+    ratings_count = models.IntegerField(default=0, editable=False)
+    comments_count = models.IntegerField(default=0, editable=False)
+    photos_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.FloatField(default=0.0, editable=False)
+    rating_weight = models.FloatField(default=0.0, editable=False)
+    # Ratings per star, null until backfilled by the repair_item_counters command
+    stars_1 = models.IntegerField(null=True, default=0, editable=False)
+    stars_2 = models.IntegerField(null=True, default=0, editable=False)
+    stars_3 = models.IntegerField(null=True, default=0, editable=False)
+    stars_4 = models.IntegerField(null=True, default=0, editable=False)
+    stars_5 = models.IntegerField(null=True, default=0, editable=False)
+
+    star_fields = {1: 'stars_1', 2: 'stars_2', 3: 'stars_3', 4: 'stars_4', 5: 'stars_5'}
+
+    # Maintained with atomic updates through `touch`, never written back by `save`
+    counter_fields = ['flags', 'ratings_count', 'comments_count', 'photos_count', 'rating_sum', 'rating_weight'] + \
+        list(star_fields.values())
+
+    # Items which are not removed are also indexed by a partial index on (id, latitude, longitude), migration 0018
+    class Meta:
+        index_together = [['cell', 'status', 'gender', 'is_free', 'rating'], ['author', 'latitude', 'longitude'],
+                          ['author', 'timestamp']]
+
+    def save(self, *args, **kwargs):
+        self.cell = spatial.get_cell(self.latitude, self.longitude)
+        inserting = self.pk is None or kwargs.get('force_insert')
+        if inserting:
+            self.version += 1
+        else:
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                           if not field.primary_key and field.name not in self.counter_fields]
+            # Bumped in the database so that a concurrent `touch` is never written back over
+            self.version = F('version') + 1
+        super().save(*args, **kwargs)
+        if not inserting:
+            self.refresh_from_db(fields=['version'])
+        tile_cache.invalidate_tile(self.cell)
+        nearest_index.update(self.pk, self.latitude, self.longitude, self.status != ItemStatusChoices.REMOVED)
+
+    def touch(self, **counters):
+        """
+        Marks the item as changed when one of its comments, photos or ratings changes, adding the given deltas to
+        the counters in the same update. Returns the counters as they were right before the update.
+        """
+
+        with transaction.atomic():
+            previous = Item.objects.select_for_update().filter(pk=self.pk).values('version', *counters).first()
+            self.updated_at = timezone.now()
+            changes = {field: F(field) + delta for field, delta in counters.items()}
+            Item.objects.filter(pk=self.pk).update(version=F('version') + 1, updated_at=self.updated_at, **changes)
+
+        self.version = previous.pop('version') + 1
+        for field, delta in counters.items():
+            setattr(self, field, None if previous[field] is None else previous[field] + delta)
+        tile_cache.invalidate_tile(self.cell)
+        return previous
+
+    def repair(self, **values):
+        """
+        Writes values recomputed by a repair, in an atomic update which marks the item as changed like `touch`
+        """
+
+        self.updated_at = timezone.now()
+        Item.objects.filter(pk=self.pk).update(version=F('version') + 1, updated_at=self.updated_at, **values)
+        for field, value in values.items():
+            setattr(self, field, value)
+        self.refresh_from_db(fields=['version'])
+        tile_cache.invalidate_tile(self.cell)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            DeletedItem.objects.create(item_id=self.pk, latitude=self.latitude, longitude=self.longitude)
+            deleted = super().delete(*args, **kwargs)
+        tile_cache.invalidate_tile(self.cell)
+        nearest_index.update(self.pk, self.latitude, self.longitude, False)
+        return deleted
+
+    def update_rating(self):
+        """
+        Derives the rating and the status from the running rating sums and the counters
+        """
+
+        if self.rating_weight == 0.0:
             return 0.0
-        self.rating /= weight
+        self.rating = self.rating_sum / self.rating_weight
 
-        if (self.ratings.count() > 5 or self.comments.count() + self.photos.count() > 3) and self.flags < 5:
+        if (self.ratings_count > 5 or self.comments_count + self.photos_count > 3) and self.flags < 5:
             self.status = ItemStatusChoices.VERIFIED
         elif self.flags > 15:
             self.status = ItemStatusChoices.REMOVED
         else:
             self.status = ItemStatusChoices.UNVERIFIED
 
+    def recalculate_rating(self):
+        """
+        Recomputes the running rating sums from every rating of the item, the sums are not written by `save`
+        """
+
+        totals = self.ratings.aggregate(total=Sum(F('rating') * F('weight')), weight=Sum('weight'))
+        self.rating_sum = totals['total'] or 0.0
+        self.rating_weight = totals['weight'] or 0.0
+        self.update_rating()
+
+
+class DeletedItem(models.Model):
+    """
+    Tombstone of a deleted item, so that the clients syncing with `changes_since` learn of the deletion
+    """
+
+    item_id = models.IntegerField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+def get_searchable_locations():
+    return Item.objects.exclude(status=ItemStatusChoices.REMOVED).values_list('id', 'latitude', 'longitude')
+
+
+nearest_index = spatial.NearestIndex(get_searchable_locations, max_age=Configurations.NEAREST_INDEX_MAX_AGE)
+
 
 class Rating(models.Model):
     item = models.ForeignKey(Item, related_name='ratings')
@@ -95,9 +210,19 @@ class Rating(models.Model):
     rating = models.FloatField(default=0.0)
     timestamp = models.DateTimeField(auto_now_add=True, null=True)
     is_anonymous = models.BooleanField(default=False)
+    weight = models.FloatField(default=1.0)
 
     class Meta:
         unique_together = [['item', 'author']]
+        index_together = [['author', 'timestamp']]
+
+    def get_weight(self):
+        """
+        The weight of the rating in the item rating, kept on the rating so that it can be taken back out exactly
+        """
+
+        # Could be a function of the user : max(0.0, self.author.reputation)
+        return 1.0
 
 
 class Reactable(models.Model):
@@ -109,6 +234,9 @@ class Reactable(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     experience = models.FloatField(default=0)
 
+    vote_fields = {ReactionChoices.UPVOTE: 'upvotes', ReactionChoices.DOWNVOTE: 'downvotes',
+                   ReactionChoices.FLAG: 'flags'}
+
     @staticmethod
     def convert_to_score(count, scale, values=(1, 10, 50, 200, 1000), scores=(1, 2, 4, 8, 16)):
         if count <= values[0]:
@@ -138,24 +266,101 @@ class Reactable(models.Model):
 
         return score
 
+    @classmethod
+    def get_vote_counts(cls):
+        """
+        Returns the aggregates counting the reactions of every kind, to be used in a single query
+        """
+
+        return {field: count_when(reaction=reaction) for reaction, field in cls.vote_fields.items()}
+
     def recalculate_votes(self):
-        self.upvotes = Reaction.objects.filter(reactable=self, reaction=ReactionChoices.UPVOTE).count()
-        self.downvotes = Reaction.objects.filter(reactable=self, reaction=ReactionChoices.DOWNVOTE).count()
-        self.flags = Reaction.objects.filter(reactable=self, reaction=ReactionChoices.FLAG).count()
+        """
+        Recounts the votes from the reactions, the counters are otherwise kept by `change_vote`
+        """
+
+        counts = Reaction.objects.filter(reactable=self).aggregate(**self.get_vote_counts())
+        for field, count in counts.items():
+            setattr(self, field, count or 0)
+
+    def change_vote(self, previous, current):
+        """
+        Moves one vote from the `previous` reaction to the `current` one with an atomic update of the counters,
+        either may be None. Returns whether the counters changed.
+        """
+
+        changes = {}
+        if previous in self.vote_fields:
+            changes[self.vote_fields[previous]] = -1
+        if current in self.vote_fields:
+            changes[self.vote_fields[current]] = changes.get(self.vote_fields[current], 0) + 1
+        changes = {field: delta for field, delta in changes.items() if delta}
+        if not changes:
+            return False
+
+        Reactable.objects.filter(pk=self.pk).update(**{field: F(field) + delta for field, delta in changes.items()})
+        self.refresh_from_db(fields=list(changes))
+        return True
 
 
 class Reaction(models.Model):
+    """
+    The vote and the flag of a user on a comment or photo. An author has at most one vote and one flag on a
+    reactable, enforced by the partial unique indexes of migration 0017.
+    """
+
     reaction = models.IntegerField(choices=ReactionChoices.get(), default=ReactionChoices.NONE)
     reactable = models.ForeignKey(Reactable, related_name='reactions')
     author = models.ForeignKey(UserProfile)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def get_reactions(cls, reactable_id, author_id, flag=False):
+        reactions = cls.objects.filter(reactable_id=reactable_id, author_id=author_id)
+        if flag:
+            return reactions.filter(reaction=ReactionChoices.FLAG)
+        return reactions.exclude(reaction=ReactionChoices.FLAG)
+
+    @classmethod
+    def set_reaction(cls, reactable_id, author_id, reaction, flag=False):
+        """
+        Stores the vote, or the flag, of the author on the reactable with a locked read and a single write, and
+        returns the reaction it replaced, None if there was none. A `reaction` of None removes it.
+        """
+
+        for attempt in range(2):
+            with transaction.atomic():
+                current = cls.get_reactions(reactable_id, author_id, flag).select_for_update() \
+                    .values_list('pk', 'reaction').first()
+                if current is None:
+                    if reaction is None:
+                        return None
+                    try:
+                        with transaction.atomic():
+                            cls.objects.create(reactable_id=reactable_id, author_id=author_id, reaction=reaction)
+                        return None
+                    except IntegrityError:
+                        # A concurrent request of the same author stored its reaction first, read it once again
+                        if attempt:
+                            raise
+                        continue
+
+                pk, previous = current
+                if reaction is None:
+                    cls.objects.filter(pk=pk).delete()
+                elif reaction != previous:
+                    cls.objects.filter(pk=pk).update(reaction=reaction)
+                return previous
+
 
 class ItemFlags(models.Model):
     item = models.ForeignKey(Item, related_name='itemflags')
     author = models.ForeignKey(UserProfile)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        index_together = [['item', 'author']]
+
 
 class Comment(Reactable):
     item = models.ForeignKey(Item, related_name='comments')
@@ -167,9 +372,14 @@ class Comment(Reactable):
         unique_together = [['item', 'author']]
 
     def recalculate_score(self):
+        """
+        Updates the experience from the votes, returns the change to apply to the reputation of the author
+        """
+
         score = super().recalculate_score()
-        self.author.reputation += (score - self.experience)
+        delta = score - self.experience
         self.experience = score
+        return delta
 
 
 class Photo(Reactable):
@@ -179,6 +389,41 @@ class Photo(Reactable):
     is_anonymous = models.BooleanField(default=False)
 
     def recalculate_score(self):
+        """
+        Updates the experience from the votes, returns the change to apply to the reputation of the author
+        """
+
         score = super().recalculate_score()
-        self.author.reputation += (score - self.experience)
-        self.experience = score
\ No newline at end of file
+        delta = score - self.experience
+        self.experience = score
+        return delta
+
+
+class RecomputeJobKinds:
+    REACTABLE = 0
+    ITEM = 1
+    REPUTATION = 2
+    PROFILE_STATS = 3
+
+    @classmethod
+    def get(cls):
+        return [(cls.REACTABLE, 'Votes and score of a comment or photo'),
+                (cls.ITEM, 'Rating and status of an item'),
+                (cls.REPUTATION, 'Reputation of a user'),
+                (cls.PROFILE_STATS, 'Contribution counts of a user')]
+
+
+class RecomputeJob(models.Model):
+    """
+    Pending recompute of a derived value, a single row per object however often it was requested. The row is
+    deleted once the recompute succeeds.
+    """
+
+    kind = models.IntegerField(choices=RecomputeJobKinds.get())
+    object_id = models.IntegerField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set while a worker runs the job, see item.jobs
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [['kind', 'object_id']]
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+from django.db import connections
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over the primary key, with an estimated count in place of a COUNT(*) of the table
+    """
+
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    @staticmethod
+    def estimate_count(queryset):
+        """
+        Returns the planner's row estimate of the table on PostgreSQL, a catalog lookup. Other databases and
+        filtered querysets are not estimated.
+        """
+
+        connection = connections[queryset.db]
+        if queryset.query.where or connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.estimated_count = self.estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('estimated_count', self.estimated_count),
+            ('results', data)
+        ]))
@@ -0,0 +1,51 @@
+import struct
+
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+
+from item.serializers import MarkerSerializer
+
+
+class MarkerJSONRenderer(JSONRenderer):
+    """
+    Renders `MarkerSerializer` columns as json, selected by `?format=markers` or the media type
+    """
+
+    media_type = 'application/vnd.hermes.markers+json'
+    format = 'markers'
+
+
+class MarkerBinaryRenderer(BaseRenderer):
+    """
+    Renders `MarkerSerializer` columns as packed little endian records, selected by `?format=markers-binary`
+    or the media type.
+
+    The body is the magic `HMK1` and the uint32 record count, followed by one 19 byte record per marker:
+    uint32 id, int32 latitude and int32 longitude in microdegrees, uint8 gender, uint8 is_free, float32 rating
+    and uint8 status. The other values next to the columns, like the `next` cursor, are sent as `X-Markers-*`
+    headers, `X-Markers-Next` for `next`. Anything other than markers, like errors, is rendered as json.
+    """
+
+    media_type = 'application/vnd.hermes.markers'
+    format = 'markers-binary'
+    charset = None
+    render_style = 'binary'
+
+    header = struct.Struct('<4sI')
+    record = struct.Struct('<IiiBBfB')
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict) or any(field not in data for field in MarkerSerializer.fields):
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+        response = renderer_context.get('response') if renderer_context else None
+        if response is not None:
+            for field, value in data.items():
+                if field not in MarkerSerializer.fields and field != 'count' and value is not None:
+                    response['X-Markers-' + field.replace('_', '-').title()] = str(value)
+
+        body = bytearray(self.header.pack(b'HMK1', data['count']))
+        for pk, latitude, longitude, gender, is_free, rating, status in zip(*(data[field] for field in
+                                                                              MarkerSerializer.fields)):
+            body += self.record.pack(pk, int(round(latitude * 1e6)), int(round(longitude * 1e6)), gender, is_free,
+                                     rating, status)
+        return bytes(body)
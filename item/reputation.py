@@ -0,0 +1,99 @@
+"""
+Reputation of the users.
+
+The reputation of a user is the experience of their comments and photos, one point per reaction they made and the
+score of every item they added. Write paths apply the change they cause with `add_reputation`, and
+`compute_reputations` recomputes it from scratch to reconcile those deltas.
+"""
+
+from django.db.models import F, Sum, Count
+
+from account.models import UserProfile
+from account.stats import forget_profile
+from item.models import Item, Comment, Photo, Reaction, count_when
+
+ITEM_SCORE_FIELDS = ['flags', 'ratings_count', 'comments_count', 'photos_count']
+
+
+def get_item_counters(item):
+    return {field: getattr(item, field) for field in ITEM_SCORE_FIELDS}
+
+
+def get_item_score(counters):
+    score = 5
+    if counters['ratings_count'] > 5:
+        score += 5
+    if counters['comments_count'] > 5:
+        score += 5
+    if counters['photos_count'] > 5:
+        score += 5
+    if counters['flags'] > 5:
+        score -= 15
+    if 0 < counters['flags'] <= 5:
+        score -= 5
+    return score
+
+
+def add_reputation(profile_id, delta):
+    if delta:
+        UserProfile.objects.filter(pk=profile_id).update(**UserProfile.changed(reputation=F('reputation') + delta))
+
+
+def add_item_change(item, previous):
+    """
+    Applies the change of the item score to its author, `previous` holds the counters before `Item.touch`
+    """
+
+    current = get_item_counters(item)
+    before = dict(current, **{field: value for field, value in previous.items() if field in ITEM_SCORE_FIELDS})
+    add_reputation(item.author_id, get_item_score(current) - get_item_score(before))
+
+
+def compute_reputations(profile_ids):
+    """
+    Returns the reputation of every profile recomputed from scratch, in a constant number of aggregate queries
+    """
+
+    reputations = {profile_id: 0.0 for profile_id in profile_ids}
+
+    for model in [Comment, Photo]:
+        experience = model.objects.filter(author_id__in=profile_ids).order_by().values_list('author_id') \
+            .annotate(experience=Sum('experience'))
+        for profile_id, value in experience:
+            reputations[profile_id] += value or 0.0
+
+    reactions = Reaction.objects.filter(author_id__in=profile_ids).order_by().values_list('author_id') \
+        .annotate(count=Count('pk'))
+    for profile_id, count in reactions:
+        reputations[profile_id] += count
+
+    items = Item.objects.filter(author_id__in=profile_ids).order_by().values('author_id') \
+        .annotate(count=Count('pk'),
+                  ratings=count_when(ratings_count__gt=5),
+                  comments=count_when(comments_count__gt=5),
+                  photos=count_when(photos_count__gt=5),
+                  flagged=count_when(flags__gt=5),
+                  warned=count_when(flags__gt=0, flags__lte=5))
+    for row in items:
+        reputations[row['author_id']] += 5 * (row['count'] + row['ratings'] + row['comments'] + row['photos']) - \
+            15 * row['flagged'] - 5 * row['warned']
+
+    return reputations
+
+
+def reconcile_reputations(profile_ids, repair=True, tolerance=1e-6):
+    """
+    Compares the stored reputation of the profiles with a full recompute, returns the mismatched
+    (profile id, stored, recomputed) and writes the recomputed values when repairing
+    """
+
+    reputations = compute_reputations(profile_ids)
+    mismatched = []
+    for profile_id, stored in UserProfile.objects.filter(pk__in=profile_ids).values_list('id', 'reputation'):
+        if abs(stored - reputations[profile_id]) > tolerance:
+            mismatched.append((profile_id, stored, reputations[profile_id]))
+            if repair:
+                UserProfile.objects.filter(pk=profile_id) \
+                    .update(**UserProfile.changed(reputation=reputations[profile_id]))
+                forget_profile(profile_id)
+    return mismatched
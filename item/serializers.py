@@ -1,19 +1,41 @@
 from rest_framework import serializers
 
 from account.serializers import UserProfileSerializer
+from item import spatial
 from item.models import Item, Comment, Photo, Rating, WashroomTypes, ItemFlags
+from project_hermes.hermes_config import Configurations
 
 
 class AuthorSerializer(serializers.ModelSerializer):
     author = serializers.SerializerMethodField()
 
+    deferred_user_fields = ['password', 'last_login', 'is_superuser', 'is_staff', 'is_active', 'date_joined']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Loads the authors with their users in the same query, leaving out the user columns which are not serialized
+        """
+
+        return queryset.select_related('author__user').defer(*['author__user__' + field
+                                                               for field in cls.deferred_user_fields])
+
+    @classmethod
+    def setup_author_loading(cls, profiles):
+        """
+        Loads the authors of a profile queryset with their users the same way
+        """
+
+        return profiles.select_related('user').defer(*['user__' + field for field in cls.deferred_user_fields])
+
     def get_author(self, item):
         try:
             user = self.context['request'].user
         except KeyError:
             user = None
 
-        if user == item.author.user or not item.is_anonymous:
+        if self.context.get('show_anonymous') or item.author.user_id == getattr(user, 'pk', None) or \
+                not item.is_anonymous:
             return UserProfileSerializer(item.author).data
         return None
 
@@ -31,11 +53,65 @@ class ItemSerializer(AuthorSerializer):
 
     class Meta:
         model = Item
+        # Kept for the server, the counts are served by the endpoints of the comments, photos and stars
+        exclude = ('cell', 'version', 'ratings_count', 'comments_count', 'photos_count', 'rating_sum',
+                   'rating_weight') + tuple(Item.star_fields.values())
+
+
+class TileItemSerializer(ItemSerializer):
+    """
+    Item as cached in the map tiles, with the id of its author, whose profile is attached for every request
+    """
+
+    author = serializers.IntegerField(source='author_id')
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset
+
+
+class MarkerSerializer:
+    """
+    Columnar serializer of the fields needed to draw map markers.
+    Values are read as tuples straight from a queryset, skipping model instances and per field serialization.
+    A list of already loaded items, like a page, is read by attribute.
+    """
+
+    fields = ('id', 'latitude', 'longitude', 'gender', 'is_free', 'rating', 'status')
+
+    def __init__(self, items):
+        self.items = items
 
+    @property
+    def data(self):
+        if isinstance(self.items, list):
+            rows = [tuple(getattr(item, field) for field in self.fields) for item in self.items]
+        else:
+            rows = list(self.items.values_list(*self.fields))
+        columns = list(zip(*rows)) if rows else [()] * len(self.fields)
+        response = {'count': len(rows)}
+        for field, column in zip(self.fields, columns):
+            response[field] = list(column)
+        return response
 
-class CommentSerializer(AuthorSerializer):
+
+class ReactableSerializer(AuthorSerializer):
+    """
+    Comment or photo. The vote counters and the experience are kept by the reactions, and the item can not be
+    changed once the comment or photo is created.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            fields['item'].read_only = True
+        return fields
+
+
+class CommentSerializer(ReactableSerializer):
     class Meta:
         model = Comment
+        read_only_fields = ('upvotes', 'downvotes', 'flags', 'experience')
 
 
 class ItemFlagsSerializer(serializers.ModelSerializer):
@@ -43,14 +119,16 @@ class ItemFlagsSerializer(serializers.ModelSerializer):
         model = ItemFlags
 
 
-class PhotoSerializer(AuthorSerializer):
+class PhotoSerializer(ReactableSerializer):
     class Meta:
         model = Photo
+        read_only_fields = ('upvotes', 'downvotes', 'flags', 'experience')
 
 
 class RatingSerializer(AuthorSerializer):
     class Meta:
         model = Rating
+        exclude = ('weight',)
 
 
 class CreateItemSerializer(serializers.Serializer):
@@ -93,7 +171,30 @@ class BoundingBoxSerializer(serializers.Serializer):
     max_latitude = serializers.FloatField()
     min_longitude = serializers.FloatField()
     max_longitude = serializers.FloatField()
+    zoom = serializers.IntegerField(required=False, min_value=0, max_value=spatial.LEVELS)
+    max_points = serializers.IntegerField(required=False, min_value=1, max_value=Configurations.MAX_CLUSTERS)
+    after = serializers.IntegerField(default=0, min_value=0)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=1000)
+    stream = serializers.BooleanField(default=False)
+    gender = serializers.MultipleChoiceField(choices=WashroomTypes.get(), required=False)
+    is_free = serializers.NullBooleanField(required=False)
+    min_rating = serializers.FloatField(required=False, min_value=0.0, max_value=5.0)
+    verified_only = serializers.BooleanField(default=False)
 
     def validate_values(self):
         return self.min_latitude <= self.max_latitude and self.min_longitude <= self.max_longitude
 
+
+class NearestSerializer(serializers.Serializer):
+    latitude = serializers.FloatField()
+    longitude = serializers.FloatField()
+    k = serializers.IntegerField(default=10, min_value=1, max_value=100)
+    max_distance = serializers.FloatField(required=False, min_value=0.0)
+
+
+class ChangesSinceSerializer(serializers.Serializer):
+    min_latitude = serializers.FloatField()
+    max_latitude = serializers.FloatField()
+    min_longitude = serializers.FloatField()
+    max_longitude = serializers.FloatField()
+    since = serializers.DateTimeField()
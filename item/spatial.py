@@ -0,0 +1,301 @@
+"""
+Spatial indexes for location based lookups.
+
+Every location is mapped onto a quadtree of the whole globe, `LEVELS` deep. The cell key is the interleaved
+(morton) code of the longitude and latitude cell numbers, so every cell of a coarser level is one contiguous range
+of keys. A bounding box is answered by covering it with cells and filtering on those key ranges.
+
+Nearest neighbour searches are answered from an in-memory KD-tree over the unit vectors of the locations.
+"""
+
+import heapq
+import math
+import threading
+import time
+
+LEVELS = 16
+
+MAX_COVERING_CELLS = 64
+
+
+def _grid_position(value, minimum, span, level):
+    cells = 1 << level
+    position = int((value - minimum) / span * cells)
+    return min(max(position, 0), cells - 1)
+
+
+def _interleave(x, y, level):
+    key = 0
+    for bit in range(level):
+        key |= ((x >> bit) & 1) << (2 * bit)
+        key |= ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def get_cell(latitude, longitude, level=LEVELS):
+    """
+    Returns the cell key of the location at the given level
+    """
+
+    x = _grid_position(longitude, -180.0, 360.0, level)
+    y = _grid_position(latitude, -90.0, 180.0, level)
+    return _interleave(x, y, level)
+
+
+def get_cell_range(cell, level):
+    """
+    Returns the inclusive range of full resolution keys that lie inside a cell of the given level
+    """
+
+    shift = 2 * (LEVELS - level)
+    return cell << shift, ((cell + 1) << shift) - 1
+
+
+def get_cells(min_latitude, max_latitude, min_longitude, max_longitude, level):
+    """
+    Returns the cells of the given level which intersect the box
+    """
+
+    cells = []
+    for x in range(_grid_position(min_longitude, -180.0, 360.0, level),
+                   _grid_position(max_longitude, -180.0, 360.0, level) + 1):
+        for y in range(_grid_position(min_latitude, -90.0, 180.0, level),
+                       _grid_position(max_latitude, -90.0, 180.0, level) + 1):
+            cells.append(_interleave(x, y, level))
+    return cells
+
+
+def count_cells(min_latitude, max_latitude, min_longitude, max_longitude, level):
+    """
+    Returns how many cells of the given level intersect the box, without listing them
+    """
+
+    columns = _grid_position(max_longitude, -180.0, 360.0, level) - \
+        _grid_position(min_longitude, -180.0, 360.0, level) + 1
+    rows = _grid_position(max_latitude, -90.0, 180.0, level) - \
+        _grid_position(min_latitude, -90.0, 180.0, level) + 1
+    return columns * rows
+
+
+def get_covering_cells(min_latitude, max_latitude, min_longitude, max_longitude, max_cells=MAX_COVERING_CELLS):
+    """
+    Returns the level and the cells of the deepest level at which at most `max_cells` cells cover the box
+    """
+
+    level = LEVELS
+    while level > 0:
+        if count_cells(min_latitude, max_latitude, min_longitude, max_longitude, level) <= max_cells:
+            break
+        level -= 1
+
+    return level, get_cells(min_latitude, max_latitude, min_longitude, max_longitude, level)
+
+
+def get_covering_ranges(min_latitude, max_latitude, min_longitude, max_longitude, max_cells=MAX_COVERING_CELLS):
+    """
+    Returns the merged, inclusive key ranges of the cells covering the box
+    """
+
+    level, cells = get_covering_cells(min_latitude, max_latitude, min_longitude, max_longitude, max_cells)
+    ranges = []
+    for low, high in sorted(get_cell_range(cell, level) for cell in cells):
+        if ranges and ranges[-1][1] + 1 == low:
+            ranges[-1] = (ranges[-1][0], high)
+        else:
+            ranges.append((low, high))
+    return ranges
+
+
+EARTH_RADIUS = 6371.0088
+
+
+def get_vector(latitude, longitude):
+    """
+    Returns the unit vector of the location, chord lengths between these vectors grow with great-circle distance
+    """
+
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return (math.cos(latitude) * math.cos(longitude),
+            math.cos(latitude) * math.sin(longitude),
+            math.sin(latitude))
+
+
+def get_distance(latitude, longitude, other_latitude, other_longitude):
+    """
+    Returns the great-circle distance in kilometers
+    """
+
+    phi, other_phi = math.radians(latitude), math.radians(other_latitude)
+    half_chord = math.sin((other_phi - phi) / 2) ** 2 + \
+        math.cos(phi) * math.cos(other_phi) * math.sin(math.radians(other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def get_chord(distance):
+    """
+    Returns the chord length between unit vectors which are `distance` kilometers apart
+    """
+
+    return 2 * math.sin(min(distance / EARTH_RADIUS, math.pi) / 2)
+
+
+class KDNode:
+    __slots__ = ['key', 'latitude', 'longitude', 'vector', 'axis', 'left', 'right', 'removed']
+
+    def __init__(self, key, latitude, longitude, axis):
+        self.key = key
+        self.latitude = latitude
+        self.longitude = longitude
+        self.vector = get_vector(latitude, longitude)
+        self.axis = axis
+        self.left = None
+        self.right = None
+        self.removed = False
+
+
+class KDTree:
+    """
+    3-d tree over location vectors with incremental inserts and removals.
+    The tree is rebuilt balanced once the inserts or removals since the last build outnumber the built nodes.
+    """
+
+    def __init__(self, points=()):
+        self.nodes = {}
+        self.root = None
+        self.changes = 0
+        self.build(points)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def build(self, points):
+        self.nodes = {}
+        self.changes = 0
+        self.root = self._build([KDNode(key, latitude, longitude, 0) for key, latitude, longitude in points], 0)
+
+    def _build(self, nodes, axis):
+        if not nodes:
+            return None
+        nodes.sort(key=lambda node: node.vector[axis])
+        middle = len(nodes) // 2
+        node = nodes[middle]
+        node.axis = axis
+        node.left = self._build(nodes[:middle], (axis + 1) % 3)
+        node.right = self._build(nodes[middle + 1:], (axis + 1) % 3)
+        self.nodes[node.key] = node
+        return node
+
+    def _rebuild(self):
+        self.build((node.key, node.latitude, node.longitude) for node in list(self.nodes.values()))
+
+    def insert(self, key, latitude, longitude):
+        self.remove(key)
+        node = KDNode(key, latitude, longitude, 0)
+        self.nodes[key] = node
+        self.changes += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        parent, depth = self.root, 1
+        while True:
+            side = 'left' if node.vector[parent.axis] < parent.vector[parent.axis] else 'right'
+            child = getattr(parent, side)
+            if child is None:
+                node.axis = (parent.axis + 1) % 3
+                setattr(parent, side, node)
+                break
+            parent, depth = child, depth + 1
+
+        if depth > 2 * len(self.nodes).bit_length() + 8 or self.changes > max(len(self.nodes), 64):
+            self._rebuild()
+
+    def remove(self, key):
+        node = self.nodes.pop(key, None)
+        if node is not None:
+            node.removed = True
+            self.changes += 1
+            if self.changes > max(len(self.nodes), 64):
+                self._rebuild()
+
+    def nearest(self, latitude, longitude, count, max_distance=None):
+        """
+        Returns up to `count` (distance, key) pairs sorted by great-circle distance
+        """
+
+        target = get_vector(latitude, longitude)
+        radius = get_chord(max_distance) ** 2 if max_distance is not None else float('inf')
+        heap = []
+
+        def search(node):
+            if node is None:
+                return
+            if not node.removed:
+                distance = sum((a - b) ** 2 for a, b in zip(node.vector, target))
+                if distance <= radius:
+                    if len(heap) < count:
+                        heapq.heappush(heap, (-distance, node.key))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, node.key))
+
+            difference = target[node.axis] - node.vector[node.axis]
+            near, far = (node.left, node.right) if difference < 0 else (node.right, node.left)
+            search(near)
+            bound = -heap[0][0] if len(heap) == count else radius
+            if difference ** 2 <= bound:
+                search(far)
+
+        if count > 0:
+            search(self.root)
+
+        results = []
+        for distance, key in sorted(heap, key=lambda entry: -entry[0]):
+            node = self.nodes[key]
+            results.append((get_distance(latitude, longitude, node.latitude, node.longitude), key))
+        return results
+
+
+class NearestIndex:
+    """
+    Process wide KD-tree of the searchable locations.
+    It is loaded lazily through `loader`, kept current by `update` and reloaded after `max_age` seconds so that
+    writes made by other processes show up.
+    """
+
+    def __init__(self, loader, max_age=600):
+        self.loader = loader
+        self.max_age = max_age
+        self.tree = None
+        self.loaded = 0
+        self.lock = threading.Lock()
+
+    def update(self, key, latitude, longitude, searchable=True):
+        with self.lock:
+            if self.tree is None:
+                return
+            if searchable:
+                self.tree.insert(key, latitude, longitude)
+            else:
+                self.tree.remove(key)
+
+    def nearest(self, latitude, longitude, count, max_distance=None):
+        with self.lock:
+            if self.tree is None or time.time() - self.loaded > self.max_age:
+                self.tree = KDTree(self.loader())
+                self.loaded = time.time()
+            return self.tree.nearest(latitude, longitude, count, max_distance)
+
+
+CLUSTER_LEVEL_OFFSET = 3
+
+
+def get_cluster_level(min_latitude, max_latitude, min_longitude, max_longitude, max_points, zoom=None):
+    """
+    Returns the cell level to group a box by, coarse enough that the box spans at most `max_points` cells and at
+    most `CLUSTER_LEVEL_OFFSET` levels below the map zoom
+    """
+
+    level = get_covering_cells(min_latitude, max_latitude, min_longitude, max_longitude, max_points)[0]
+    if zoom is not None:
+        level = min(level, zoom + CLUSTER_LEVEL_OFFSET)
+    return level
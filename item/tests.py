@@ -1,3 +1,872 @@
-from django.test import TestCase
+import io
+import json
+import random
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from account.models import UserProfile
+from item import jobs, spatial
+from item.renderers import MarkerBinaryRenderer
+from item.reputation import add_reputation, reconcile_reputations
+from item.models import Item, Comment, Photo, Rating, Reaction, ReactionChoices, ItemStatusChoices, WashroomTypes, RecomputeJob, RecomputeJobKinds, nearest_index
+from project_hermes.hermes_config import Configurations
+
+
+def create_profile(username='author'):
+    user = User.objects.create(username=username, email=username + '@example.com', first_name=username)
+    return UserProfile.objects.create(user=user)
+
+
+def create_item(author, latitude=12.97, longitude=77.59, **kwargs):
+    return Item.objects.create(title='Item', author=author, latitude=latitude, longitude=longitude, **kwargs)
+
+
+def run_pending_jobs():
+    """
+    Runs the queued recomputes in this thread, inside the transaction of the test
+    """
+
+    with mock.patch('item.jobs.connection'):
+        while True:
+            claimed = jobs.claim_jobs(100)
+            if not claimed:
+                break
+            for job in claimed:
+                jobs.run_jobs(job.kind, [job])
+
+
+def create_image():
+    image = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(image, 'PNG')
+    return SimpleUploadedFile('photo.png', image.getvalue(), content_type='image/png')
+
+
+class ItemVersionTest(TestCase):
+
+    def setUp(self):
+        self.item = create_item(create_profile())
+
+    def test_save_after_concurrent_touch(self):
+        stale = Item.objects.get(pk=self.item.pk)
+        self.item.touch(comments_count=1)
+        stale.title = 'Renamed'
+        stale.save()
+
+        self.assertEqual(stale.version, 3)
+        self.assertEqual(Item.objects.get(pk=self.item.pk).version, 3)
+        self.assertEqual(Item.objects.get(pk=self.item.pk).comments_count, 1)
+
+    def test_every_change_has_its_own_version(self):
+        versions = {self.item.version}
+        stale = Item.objects.get(pk=self.item.pk)
+        for _ in range(3):
+            self.item.touch()
+            versions.add(self.item.version)
+            stale.save()
+            versions.add(stale.version)
+        self.assertEqual(len(versions), 7)
+
+
+class ConditionalReadTest(TestCase):
+
+    def setUp(self):
+        self.author = create_profile()
+        self.commenter = create_profile('commenter')
+        self.item = create_item(self.author)
+        Comment.objects.create(item=self.item, author=self.commenter, description='')
+
+    def get(self, action, etag=None):
+        url = '/api/item/%d/%s' % (self.item.pk, action + '/' if action else '')
+        return APIClient().get(url, **({'HTTP_IF_NONE_MATCH': etag} if etag else {}))
+
+    def test_unchanged_reads_are_not_modified(self):
+        for action in ['', 'get_comments', 'get_photos', 'get_stars']:
+            self.assertEqual(self.get(action, self.get(action)['ETag']).status_code, 304)
+
+    def test_author_changes_are_modified(self):
+        etag = self.get('')['ETag']
+        add_reputation(self.author.pk, 10)
+        response = self.get('', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author']['reputation'], 10)
+
+    def test_commenter_changes_are_modified(self):
+        etag = self.get('get_comments')['ETag']
+        self.commenter.user.first_name = 'Renamed'
+        self.commenter.user.save()
+        response = self.get('get_comments', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['author']['first_name'], 'Renamed')
+
+        etag = response['ETag']
+        self.commenter.user.last_login = timezone.now()
+        self.commenter.user.save(update_fields=['last_login'])
+        self.assertEqual(self.get('get_comments', etag).status_code, 304)
+
+
+class ReactableUpdateTest(TestCase):
+
+    def setUp(self):
+        author = create_profile()
+        self.client = APIClient()
+        self.client.force_authenticate(author.user)
+        self.item = create_item(author)
+        self.other = create_item(author)
+        self.comment = Comment.objects.create(item=self.item, author=author, description='')
+
+    def test_update_marks_the_item_changed(self):
+        url = '/api/item/%d/get_comments/' % self.item.pk
+        etag = self.client.get(url)['ETag']
+        response = self.client.patch('/api/comment/%d/' % self.comment.pk, {'description': 'Edited'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['description'], 'Edited')
+
+    def test_update_keeps_the_item_and_the_counters(self):
+        response = self.client.patch('/api/comment/%d/' % self.comment.pk,
+                                     {'item': self.other.pk, 'upvotes': 100, 'flags': 100, 'experience': 100},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        comment = Comment.objects.get(pk=self.comment.pk)
+        self.assertEqual((comment.item_id, comment.upvotes, comment.flags, comment.experience),
+                         (self.item.pk, 0, 0, 0))
+
+
+class RecomputeJobLeaseTest(TestCase):
+
+    def setUp(self):
+        jobs.enqueue(RecomputeJobKinds.ITEM, 1)
+
+    def test_leased_job_is_not_claimed_twice(self):
+        self.assertEqual(len(jobs.claim_jobs(10)), 1)
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+    def test_job_of_a_dead_worker_runs_again(self):
+        jobs.claim_jobs(10)
+        RecomputeJob.objects.update(claimed_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(len(jobs.claim_jobs(10)), 1)
+
+    def test_job_enqueued_while_running_is_kept(self):
+        claimed = jobs.claim_jobs(10)
+        jobs.enqueue(RecomputeJobKinds.ITEM, 1)
+        jobs.finish_jobs(claimed)
+        self.assertEqual(len(jobs.claim_jobs(10)), 1)
+
+    def test_finished_job_is_deleted(self):
+        jobs.finish_jobs(jobs.claim_jobs(10))
+        self.assertFalse(RecomputeJob.objects.exists())
+
+
+class RecomputeJobTest(TestCase):
+
+    def setUp(self):
+        self.item = create_item(create_profile())
+        for index in range(6):
+            client = APIClient()
+            client.force_authenticate(create_profile('rater%d' % index).user)
+            client.post('/api/item/%d/add_rating/' % self.item.pk, {'rating': 2 + index % 2}, format='json')
+
+    def test_rating_and_status_are_written_by_the_worker(self):
+        self.assertEqual(RecomputeJob.objects.count(), 1)
+        item = Item.objects.get(pk=self.item.pk)
+        self.assertEqual((item.rating, item.status), (0.0, ItemStatusChoices.UNVERIFIED))
+
+        run_pending_jobs()
+        item = Item.objects.get(pk=self.item.pk)
+        self.assertEqual((item.rating, item.status), (2.5, ItemStatusChoices.VERIFIED))
+        self.assertFalse(RecomputeJob.objects.exists())
+
+
+class CoveringCellsTest(SimpleTestCase):
+
+    def test_covering_ranges_hold_every_location_of_the_box(self):
+        generator = random.Random(1)
+        for _ in range(200):
+            min_latitude, max_latitude = sorted(generator.uniform(-89, 89) for _ in range(2))
+            min_longitude, max_longitude = sorted(generator.uniform(-179, 179) for _ in range(2))
+            if generator.random() < 0.5:
+                max_latitude = min_latitude + generator.uniform(0, 0.5)
+                max_longitude = min_longitude + generator.uniform(0, 0.5)
+            ranges = spatial.get_covering_ranges(min_latitude, max_latitude, min_longitude, max_longitude)
+            self.assertLessEqual(len(ranges), spatial.MAX_COVERING_CELLS)
+
+            for _ in range(20):
+                cell = spatial.get_cell(generator.uniform(min_latitude, max_latitude),
+                                        generator.uniform(min_longitude, max_longitude))
+                self.assertTrue(any(low <= cell <= high for low, high in ranges))
+
+
+class BoundingBoxTest(TestCase):
+    box = {'min_latitude': 12.9, 'max_latitude': 13.05, 'min_longitude': 77.5, 'max_longitude': 77.65}
+
+    def setUp(self):
+        cache.clear()
+        author = create_profile()
+        generator = random.Random(2)
+        for index in range(100):
+            create_item(author, generator.uniform(12.8, 13.2), generator.uniform(77.4, 77.8),
+                        status=ItemStatusChoices.REMOVED if index % 10 == 0 else ItemStatusChoices.UNVERIFIED)
+
+    def search(self, **data):
+        return APIClient().post('/api/item/search_bounding_box/', dict(self.box, **data), format='json')
+
+    def get_expected(self):
+        return sorted(Item.objects.filter(latitude__range=[self.box['min_latitude'], self.box['max_latitude']],
+                                          longitude__range=[self.box['min_longitude'], self.box['max_longitude']])
+                      .exclude(status=ItemStatusChoices.REMOVED).values_list('id', flat=True))
+
+    def test_cell_ranges_match_a_scan_of_the_box(self):
+        with mock.patch.object(Configurations, 'MAX_CACHED_TILES', 0):
+            response = self.search()
+        self.assertEqual([result['id'] for result in response.data['results']], self.get_expected())
+
+    def test_cached_tiles_match_a_scan_of_the_box(self):
+        for _ in range(2):
+            response = self.search()
+            self.assertEqual([result['id'] for result in response.data['results']], self.get_expected())
+
+    def test_stream_matches_a_scan_of_the_box(self):
+        with mock.patch.object(Configurations, 'STREAM_CHUNK_SIZE', 7):
+            response = self.search(stream=True)
+            body = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual([result['id'] for result in body['results']], self.get_expected())
+
+    def get_pages(self, limit):
+        ids, after = [], 0
+        while after is not None:
+            response = self.search(limit=limit, after=after)
+            self.assertLessEqual(len(response.data['results']), limit)
+            ids.extend(result['id'] for result in response.data['results'])
+            after = response.data['next']
+        return ids
+
+    def test_pages_match_a_scan_of_the_box(self):
+        self.assertEqual(self.get_pages(4), self.get_expected())
+        with mock.patch.object(Configurations, 'MAX_CACHED_TILES', 0):
+            self.assertEqual(self.get_pages(4), self.get_expected())
+
+
+class KDTreeTest(SimpleTestCase):
+
+    def brute_force(self, points, latitude, longitude, count, max_distance=None):
+        distances = sorted((spatial.get_distance(latitude, longitude, point_latitude, point_longitude), key)
+                           for key, point_latitude, point_longitude in points.values())
+        if max_distance is not None:
+            distances = [entry for entry in distances if entry[0] <= max_distance]
+        return [key for distance, key in distances[:count]]
+
+    def test_nearest_matches_brute_force(self):
+        generator = random.Random(3)
+        points = {key: (key, generator.uniform(-60, 60), generator.uniform(-180, 180)) for key in range(500)}
+        tree = spatial.KDTree(points.values())
+
+        # Inserts and removals after the build, enough to rebuild the tree
+        for key in range(500, 700):
+            points[key] = (key, generator.uniform(-60, 60), generator.uniform(-180, 180))
+            tree.insert(*points[key])
+        for key in generator.sample(list(points), 150):
+            del points[key]
+            tree.remove(key)
+
+        for _ in range(50):
+            latitude, longitude = generator.uniform(-70, 70), generator.uniform(-180, 180)
+            count = generator.randint(1, 20)
+            self.assertEqual([key for distance, key in tree.nearest(latitude, longitude, count)],
+                             self.brute_force(points, latitude, longitude, count))
+            self.assertEqual([key for distance, key in tree.nearest(latitude, longitude, count, 1000)],
+                             self.brute_force(points, latitude, longitude, count, 1000))
+
+
+class NearestTest(TestCase):
+
+    def setUp(self):
+        nearest_index.tree = None
+        author = create_profile()
+        self.near = create_item(author, 12.971, 77.591)
+        self.far = create_item(author, 12.99, 77.61)
+        self.removed = create_item(author, 12.9705, 77.5905, status=ItemStatusChoices.REMOVED)
+
+    def nearest(self, **data):
+        response = APIClient().post('/api/item/nearest/', dict({'latitude': 12.97, 'longitude': 77.59}, **data),
+                                    format='json')
+        return [result['id'] for result in response.data['results']]
+
+    def test_nearest_items_by_distance(self):
+        self.assertEqual(self.nearest(), [self.near.pk, self.far.pk])
+        self.assertEqual(self.nearest(k=1), [self.near.pk])
+        self.assertEqual(self.nearest(max_distance=1), [self.near.pk])
+
+    def test_index_follows_item_writes(self):
+        self.nearest()
+        self.far.latitude, self.far.longitude = 12.9701, 77.5901
+        self.far.save()
+        self.removed.status = ItemStatusChoices.UNVERIFIED
+        self.removed.save()
+        self.assertEqual(self.nearest(), [self.far.pk, self.removed.pk, self.near.pk])
+
+
+class ClusterTest(TestCase):
+    box = {'min_latitude': 10, 'max_latitude': 15, 'min_longitude': 75, 'max_longitude': 80}
+
+    def setUp(self):
+        author = create_profile()
+        generator = random.Random(5)
+        for index in range(60):
+            create_item(author, generator.uniform(10, 15), generator.uniform(75, 80), is_free=index % 3 == 0,
+                        gender=index % 4, rating=index % 6)
+
+    def get_clusters(self, **data):
+        response = APIClient().post('/api/item/search_bounding_box/', dict(self.box, **data), format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_clusters_summarize_the_items(self):
+        response = self.get_clusters(zoom=4)
+        clusters = response['clusters']
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 60)
+        self.assertEqual(sum(cluster['is_free'] for cluster in clusters), 20)
+        self.assertEqual(sum(cluster['gender']['male'] for cluster in clusters),
+                         Item.objects.filter(gender=WashroomTypes.MALE).count())
+        self.assertEqual(max(cluster['rating'] for cluster in clusters), 5)
+
+        for cluster in clusters:
+            low, high = spatial.get_cell_range(cluster['cell'], response['level'])
+            self.assertEqual(Item.objects.filter(cell__range=[low, high]).count(), cluster['count'])
+
+    def test_clusters_are_bounded(self):
+        for data in [{'max_points': 4}, {'max_points': 4, 'zoom': 16}, {'zoom': 16}]:
+            response = self.get_clusters(**data)
+            self.assertLessEqual(len(response['clusters']), data.get('max_points', Configurations.MAX_CLUSTERS))
+            self.assertEqual(sum(cluster['count'] for cluster in response['clusters']), 60)
+
+    def test_clusters_are_filtered(self):
+        clusters = self.get_clusters(zoom=4, is_free=True)['clusters']
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 20)
+
+
+class TileCacheTest(TestCase):
+    box = {'min_latitude': 12.9, 'max_latitude': 13.05, 'min_longitude': 77.5, 'max_longitude': 77.65}
+
+    def setUp(self):
+        cache.clear()
+        self.item = create_item(create_profile())
+
+    def search(self, box=None):
+        return APIClient().post('/api/item/search_bounding_box/', box or self.box, format='json')
+
+    def test_cached_tiles_only_load_the_authors(self):
+        self.search()
+        with self.assertNumQueries(1):
+            response = self.search()
+        self.assertEqual(response.data['results'][0]['author']['username'], 'author')
+
+    def test_saved_item_replaces_its_tile(self):
+        self.search()
+        self.item.title = 'Renamed'
+        self.item.save()
+        self.assertEqual(self.search().data['results'][0]['title'], 'Renamed')
+
+    def test_large_box_does_not_list_the_tiles(self):
+        world = {'min_latitude': -90, 'max_latitude': 90, 'min_longitude': -180, 'max_longitude': 180}
+        with mock.patch.object(spatial, 'get_cells', wraps=spatial.get_cells) as get_cells:
+            response = self.search(world)
+        self.assertEqual([result['id'] for result in response.data['results']], [self.item.pk])
+        self.assertNotIn(Configurations.TILE_LEVEL, [call[0][-1] for call in get_cells.call_args_list])
+
+
+class FilterTest(TestCase):
+    box = {'min_latitude': 12.9, 'max_latitude': 13.05, 'min_longitude': 77.5, 'max_longitude': 77.65}
+
+    def setUp(self):
+        cache.clear()
+        author = create_profile()
+        generator = random.Random(6)
+        for index in range(80):
+            create_item(author, generator.uniform(12.9, 13.05), generator.uniform(77.5, 77.65),
+                        gender=index % 4, is_free=index % 3 == 0, rating=index % 6,
+                        status=ItemStatusChoices.VERIFIED if index % 5 == 0 else ItemStatusChoices.UNVERIFIED)
+
+    def search(self, **filters):
+        response = APIClient().post('/api/item/search_bounding_box/', dict(self.box, **filters), format='json')
+        return [result['id'] for result in response.data['results']]
+
+    def test_filters_match_the_queryset(self):
+        cases = [
+            ({'gender': [WashroomTypes.MALE, WashroomTypes.BOTH]},
+             {'gender__in': [WashroomTypes.MALE, WashroomTypes.BOTH]}),
+            ({'is_free': False}, {'is_free': False}),
+            ({'min_rating': 3}, {'rating__gte': 3}),
+            ({'verified_only': True}, {'status': ItemStatusChoices.VERIFIED}),
+            ({'gender': [WashroomTypes.FEMALE], 'is_free': True, 'min_rating': 1, 'verified_only': True},
+             {'gender': WashroomTypes.FEMALE, 'is_free': True, 'rating__gte': 1,
+              'status': ItemStatusChoices.VERIFIED}),
+        ]
+        for filters, lookups in cases:
+            expected = list(Item.objects.filter(**lookups).order_by('id').values_list('id', flat=True))
+            self.assertEqual(self.search(**filters), expected)
+            with mock.patch.object(Configurations, 'MAX_CACHED_TILES', 0):
+                self.assertEqual(self.search(**filters), expected)
+
+
+class ChangesSinceTest(TestCase):
+    box = {'min_latitude': 12.9, 'max_latitude': 13.05, 'min_longitude': 77.5, 'max_longitude': 77.65}
+
+    def setUp(self):
+        author = create_profile()
+        self.client = APIClient()
+        self.client.force_authenticate(author.user)
+        self.item = create_item(author)
+        self.other = create_item(author)
+        self.outside = create_item(author, 13.5, 78)
+
+    def get_changes(self, since):
+        with mock.patch.object(Configurations, 'SYNC_WATERMARK_OVERLAP', 0):
+            response = self.client.post('/api/item/changes_since/', dict(self.box, since=since), format='json')
+        return [result['id'] for result in response.data['results']], response.data['removed'], \
+            response.data['watermark']
+
+    def test_only_changes_after_the_watermark(self):
+        results, removed, watermark = self.get_changes('2000-01-01T00:00:00Z')
+        self.assertEqual((results, removed), ([self.item.pk, self.other.pk], []))
+
+        self.item.title = 'Renamed'
+        self.item.save()
+        self.assertEqual(self.get_changes(watermark)[:2], ([self.item.pk], []))
+
+    def test_removed_and_deleted_items(self):
+        watermark = self.get_changes('2000-01-01T00:00:00Z')[2]
+        self.other.status = ItemStatusChoices.REMOVED
+        self.other.save()
+        for item in [self.item, self.outside]:
+            self.assertEqual(self.client.delete('/api/item/%d/' % item.pk).status_code, 204)
+        self.assertEqual(self.get_changes(watermark)[:2], ([], [self.item.pk, self.other.pk]))
+
+
+class MarkerTest(TestCase):
+    box = {'min_latitude': 12.9, 'max_latitude': 13.05, 'min_longitude': 77.5, 'max_longitude': 77.65}
+
+    def setUp(self):
+        author = create_profile()
+        self.items = [create_item(author, 12.95 + index * 0.001, 77.55, gender=index % 4, rating=index % 5)
+                      for index in range(5)]
+
+    def decode(self, response):
+        self.assertEqual(response['Content-Type'], MarkerBinaryRenderer.media_type)
+        magic, count = MarkerBinaryRenderer.header.unpack_from(response.content)
+        self.assertEqual(magic, b'HMK1')
+        self.assertEqual(len(response.content),
+                         MarkerBinaryRenderer.header.size + count * MarkerBinaryRenderer.record.size)
+        return [MarkerBinaryRenderer.record.unpack_from(response.content, MarkerBinaryRenderer.header.size +
+                                                        index * MarkerBinaryRenderer.record.size)
+                for index in range(count)]
+
+    def test_item_list_pages_are_binary(self):
+        records = []
+        url = '/api/item/?format=markers-binary&page_size=2'
+        while url is not None:
+            response = APIClient().get(url)
+            page = self.decode(response)
+            self.assertLessEqual(len(page), 2)
+            records.extend(page)
+            url = response.get('X-Markers-Next')
+
+        self.assertEqual([record[0] for record in records], [item.pk for item in reversed(self.items)])
+        for record, item in zip(records, reversed(self.items)):
+            self.assertEqual(record[1:3], (int(round(item.latitude * 1e6)), int(round(item.longitude * 1e6))))
+            self.assertEqual((record[3], record[4], record[6]), (item.gender, item.is_free, item.status))
+            self.assertAlmostEqual(record[5], item.rating)
+
+    def test_item_list_columns(self):
+        response = APIClient().get('/api/item/?format=markers&page_size=2')
+        self.assertEqual(response.data['id'], [self.items[4].pk, self.items[3].pk])
+        self.assertEqual(response.data['gender'], [self.items[4].gender, self.items[3].gender])
+        self.assertIsNotNone(response.data['next'])
+
+    def test_bounding_box_pages_are_binary(self):
+        response = APIClient().post('/api/item/search_bounding_box/?format=markers-binary',
+                                    dict(self.box, limit=3), format='json')
+        self.assertEqual([record[0] for record in self.decode(response)], [item.pk for item in self.items[:3]])
+        self.assertEqual(response['X-Markers-Next'], str(self.items[2].pk))
+
+
+class PaginationTest(TestCase):
+
+    def setUp(self):
+        author = create_profile()
+        self.items = [create_item(author) for _ in range(7)]
+        for item in self.items:
+            Comment.objects.create(item=item, author=author, description='')
+            Photo.objects.create(item=item, author=author, picture='photo.jpg')
+
+    def get_pages(self, url):
+        ids = []
+        while url is not None:
+            with CaptureQueriesContext(connection) as queries:
+                response = APIClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([query for query in queries if 'COUNT(' in query['sql'].upper()])
+            self.assertIsNone(response.data['estimated_count'])
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids.extend(result['id'] for result in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_lists_are_paged_by_keyset(self):
+        for path, model in [('item', Item), ('comment', Comment), ('photo', Photo)]:
+            self.assertEqual(self.get_pages('/api/%s/?page_size=3' % path),
+                             list(model.objects.order_by('-id').values_list('id', flat=True)))
+
+    def test_page_size_is_bounded(self):
+        with mock.patch('item.pagination.KeysetPagination.max_page_size', 2):
+            response = APIClient().get('/api/item/?page_size=1000')
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class AuthorLoadingTest(TestCase):
+
+    def setUp(self):
+        self.item = create_item(create_profile())
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(APIClient().get(url).status_code, 200)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_the_rows(self):
+        urls = ['/api/item/', '/api/comment/', '/api/photo/', '/api/item/%d/get_comments/' % self.item.pk,
+                '/api/item/%d/get_photos/' % self.item.pk]
+        Comment.objects.create(item=self.item, author=create_profile('first'), description='')
+        Photo.objects.create(item=self.item, author=create_profile('second'), picture='photo.jpg')
+        counts = [self.count_queries(url) for url in urls]
+
+        for index in range(5):
+            author = create_profile('author%d' % index)
+            item = create_item(author)
+            for target in [item, self.item]:
+                Comment.objects.create(item=target, author=author, description='')
+                Photo.objects.create(item=target, author=author, picture='photo.jpg')
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
+
+
+class ItemCounterTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.item = create_item(create_profile())
+        self.clients = []
+        for index in range(2):
+            client = APIClient()
+            client.force_authenticate(create_profile('user%d' % index).user)
+            self.clients.append(client)
+
+    def post(self, client, action, data=None, format='json'):
+        response = client.post('/api/item/%d/%s/' % (self.item.pk, action), data, format=format)
+        self.assertEqual(response.status_code, 200)
+
+    def get_counters(self):
+        return Item.objects.filter(pk=self.item.pk).values('flags', 'ratings_count', 'comments_count',
+                                                         'photos_count').first()
+
+    def test_write_paths_keep_the_counters(self):
+        for client in self.clients:
+            for _ in range(2):
+                self.post(client, 'add_comment', {'description': 'Comment'})
+                self.post(client, 'add_rating', {'rating': 3})
+                self.post(client, 'add_flag')
+            self.post(client, 'add_photo', {'picture': create_image()}, format='multipart')
+        self.assertEqual(self.get_counters(),
+                         {'flags': 2, 'ratings_count': 2, 'comments_count': 2, 'photos_count': 2})
+
+        for path, model in [('comment', Comment), ('photo', Photo)]:
+            reactable = model.objects.filter(item=self.item).first()
+            self.assertEqual(self.clients[0].delete('/api/%s/%d/' % (path, reactable.pk)).status_code, 204)
+        self.assertEqual(self.get_counters(),
+                         {'flags': 2, 'ratings_count': 2, 'comments_count': 1, 'photos_count': 1})
+
+    def test_repair_counts_the_rows_again(self):
+        self.post(self.clients[0], 'add_comment', {'description': 'Comment'})
+        self.post(self.clients[0], 'add_rating', {'rating': 4})
+        Item.objects.filter(pk=self.item.pk).update(comments_count=5, ratings_count=0, stars_4=None)
+
+        call_command('repair_item_counters', stdout=io.StringIO())
+        self.assertEqual(self.get_counters(),
+                         {'flags': 0, 'ratings_count': 1, 'comments_count': 1, 'photos_count': 0})
+        self.assertEqual(Item.objects.get(pk=self.item.pk).stars_4, 1)
+
+
+class RatingSumsTest(TestCase):
+
+    def setUp(self):
+        self.item = create_item(create_profile())
+        clients = []
+        for index in range(4):
+            client = APIClient()
+            client.force_authenticate(create_profile('rater%d' % index).user)
+            clients.append(client)
+
+        generator = random.Random(4)
+        for _ in range(20):
+            response = generator.choice(clients).post('/api/item/%d/add_rating/' % self.item.pk,
+                                                      {'rating': generator.randint(1, 5)}, format='json')
+            self.assertEqual(response.status_code, 200)
+
+    def test_running_sums_match_a_full_recompute(self):
+        stored = Item.objects.get(pk=self.item.pk)
+        recomputed = Item.objects.get(pk=self.item.pk)
+        recomputed.recalculate_rating()
+        self.assertAlmostEqual(stored.rating_sum, recomputed.rating_sum)
+        self.assertAlmostEqual(stored.rating_weight, recomputed.rating_weight)
+        self.assertEqual(stored.ratings_count, Rating.objects.filter(item=self.item).count())
+        for stars, field in Item.star_fields.items():
+            self.assertEqual(getattr(stored, field), Rating.objects.filter(item=self.item, rating=stars).count())
+
+    def verify(self, *args):
+        output = io.StringIO()
+        call_command('verify_item_ratings', *args, stdout=output)
+        return output.getvalue().splitlines()[-1]
+
+    def test_verification_finds_and_repairs_mismatches(self):
+        jobs.recompute_item(self.item.pk)
+        self.assertEqual(self.verify(), 'Checked 1 items, 0 mismatched')
+
+        Item.objects.filter(pk=self.item.pk).update(rating_sum=F('rating_sum') + 1)
+        self.assertEqual(self.verify(), 'Checked 1 items, 1 mismatched')
+        self.assertEqual(self.verify('--repair'), 'Checked 1 items, 1 mismatched, repaired')
+        self.assertEqual(self.verify(), 'Checked 1 items, 0 mismatched')
+
+
+class StarsTest(TestCase):
+
+    def setUp(self):
+        self.item = create_item(create_profile())
+        for index, stars in enumerate([5, 5, 3, 1]):
+            client = APIClient()
+            client.force_authenticate(create_profile('rater%d' % index).user)
+            client.post('/api/item/%d/add_rating/' % self.item.pk, {'rating': stars}, format='json')
+        self.expected = {'1': 1, '2': 0, '3': 1, '4': 0, '5': 2}
+
+    def get_stars(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/item/%d/get_stars/' % self.item.pk)
+        return response.data['results'], len(queries)
+
+    def test_stored_histogram(self):
+        stars, queries = self.get_stars()
+        self.assertEqual(stars, self.expected)
+        # The version of the item, then its histogram
+        self.assertEqual(queries, 2)
+
+    def test_histogram_before_the_backfill(self):
+        Item.objects.filter(pk=self.item.pk).update(stars_2=None)
+        stars, queries = self.get_stars()
+        self.assertEqual(stars, self.expected)
+        self.assertEqual(queries, 3)
+
+
+class ReputationTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.profiles = [create_profile('user%d' % index) for index in range(3)]
+        self.clients = []
+        for profile in self.profiles:
+            client = APIClient()
+            client.force_authenticate(profile.user)
+            self.clients.append(client)
+
+    def post(self, client, path, data=None, format='json'):
+        response = client.post(path, data, format=format)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def create_item(self, client):
+        return self.post(client, '/api/item/', {'title': 'Item', 'description': '', 'latitude': 12.97,
+                                                 'longitude': 77.59, 'is_anonymous': False, 'male': True,
+                                                 'female': True, 'is_free': True})['id']
+
+    def test_deltas_match_a_full_recompute(self):
+        first, second, third = self.clients
+        item = self.create_item(first)
+        deleted = self.create_item(second)
+
+        for target in [item, deleted]:
+            comment = self.post(second, '/api/item/%d/add_comment/' % target, {'description': 'Comment'})
+            self.post(second, '/api/item/%d/add_rating/' % target, {'rating': 4})
+            photo = self.post(third, '/api/item/%d/add_photo/' % target, {'picture': create_image()},
+                              format='multipart')
+            self.post(first, '/api/item/%d/add_flag/' % target)
+
+            for client in self.clients:
+                self.post(client, '/api/comment/%d/upvote/' % comment['result']['id'])
+            self.post(third, '/api/comment/%d/downvote/' % comment['result']['id'])
+            self.post(first, '/api/photo/%d/flag/' % photo['result']['id'])
+            self.post(second, '/api/photo/%d/upvote/' % photo['result']['id'])
+            self.post(second, '/api/photo/%d/unvote/' % photo['result']['id'])
+
+        self.assertEqual(second.delete('/api/photo/%d/' % photo['result']['id']).status_code, 204)
+        self.assertEqual(second.delete('/api/item/%d/' % deleted).status_code, 204)
+
+        run_pending_jobs()
+        self.assertEqual(reconcile_reputations([profile.pk for profile in self.profiles], repair=False), [])
+
+
+class VoteTest(TestCase):
+
+    def setUp(self):
+        self.comment = Comment.objects.create(item=create_item(create_profile()), author=create_profile('commenter'),
+                                              description='')
+        self.voters = [create_profile('voter%d' % index) for index in range(4)]
+        self.clients = []
+        for voter in self.voters:
+            client = APIClient()
+            client.force_authenticate(voter.user)
+            self.clients.append(client)
+
+    def react(self, client, action):
+        return client.post('/api/comment/%d/%s/' % (self.comment.pk, action))
+
+    def get_counters(self):
+        return Comment.objects.filter(pk=self.comment.pk).values_list('upvotes', 'downvotes', 'flags').first()
+
+    def test_counters_match_a_recount(self):
+        generator = random.Random(7)
+        for _ in range(60):
+            response = self.react(generator.choice(self.clients),
+                                  generator.choice(['upvote', 'downvote', 'unvote', 'flag', 'unflag']))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.data['result']['upvotes'], response.data['result']['downvotes'],
+                              response.data['result']['flags']), self.get_counters())
+
+        comment = Comment.objects.get(pk=self.comment.pk)
+        comment.recalculate_votes()
+        self.assertEqual((comment.upvotes, comment.downvotes, comment.flags), self.get_counters())
+
+    def test_failed_vote_leaves_no_reaction(self):
+        with mock.patch.object(Item, 'touch', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.react(self.clients[0], 'upvote')
+        self.assertFalse(Reaction.objects.exists())
+        self.assertEqual(self.get_counters(), (0, 0, 0))
+        self.assertEqual(UserProfile.objects.get(pk=self.voters[0].pk).reputation, 0)
+
+
+class ReactionTest(TestCase):
+
+    def setUp(self):
+        self.author = create_profile()
+        self.comment = Comment.objects.create(item=create_item(self.author), author=self.author, description='')
+
+    def set_reaction(self, reaction, flag=False):
+        return Reaction.set_reaction(self.comment.pk, self.author.pk, reaction, flag)
+
+    def test_one_vote_and_one_flag_per_author(self):
+        self.assertIsNone(self.set_reaction(ReactionChoices.UPVOTE))
+        self.assertEqual(self.set_reaction(ReactionChoices.DOWNVOTE), ReactionChoices.UPVOTE)
+        self.assertIsNone(self.set_reaction(ReactionChoices.FLAG, flag=True))
+        self.assertEqual(sorted(Reaction.objects.values_list('reaction', flat=True)),
+                         [ReactionChoices.DOWNVOTE, ReactionChoices.FLAG])
+
+        self.assertEqual(self.set_reaction(None), ReactionChoices.DOWNVOTE)
+        self.assertIsNone(self.set_reaction(None))
+        self.assertEqual(list(Reaction.objects.values_list('reaction', flat=True)), [ReactionChoices.FLAG])
+
+    def test_conflicting_insert_updates_the_concurrent_reaction(self):
+        Reaction.objects.create(reactable=self.comment, author=self.author, reaction=ReactionChoices.UPVOTE)
+        get_reactions = Reaction.get_reactions
+        calls = []
+
+        def get_reactions_before_the_concurrent_insert(*args, **kwargs):
+            calls.append(args)
+            reactions = get_reactions(*args, **kwargs)
+            return reactions.none() if len(calls) == 1 else reactions
+
+        with mock.patch.object(Reaction, 'get_reactions', side_effect=get_reactions_before_the_concurrent_insert):
+            self.assertEqual(self.set_reaction(ReactionChoices.DOWNVOTE), ReactionChoices.UPVOTE)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(Reaction.objects.values_list('reaction', flat=True)), [ReactionChoices.DOWNVOTE])
+
+
+class ReactionMigrationTest(TransactionTestCase):
+    before = [('item', '0016_recomputejob')]
+
+    def test_duplicates_are_removed_and_counted_again(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+
+        user = apps.get_model('auth', 'User').objects.create(username='author')
+        author = apps.get_model('account', 'UserProfile').objects.create(user=user)
+        item = apps.get_model('item', 'Item').objects.create(title='Item', author=author, latitude=0, longitude=0)
+        comment = apps.get_model('item', 'Comment').objects.create(item=item, author=author, description='',
+                                                                   upvotes=2, downvotes=1, flags=2)
+        HistoricalReaction = apps.get_model('item', 'Reaction')
+        for reaction in [ReactionChoices.UPVOTE, ReactionChoices.FLAG, ReactionChoices.UPVOTE,
+                         ReactionChoices.DOWNVOTE, ReactionChoices.FLAG]:
+            HistoricalReaction.objects.create(reactable_id=comment.pk, author=author, reaction=reaction)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        self.assertEqual(sorted(Reaction.objects.values_list('reaction', flat=True)),
+                         [ReactionChoices.DOWNVOTE, ReactionChoices.FLAG])
+        comment = Comment.objects.get(pk=comment.pk)
+        self.assertEqual((comment.upvotes, comment.downvotes, comment.flags), (0, 1, 1))
+
+
+class ExplainQueriesTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.author = create_profile()
+        item = create_item(self.author)
+        create_item(self.author, latitude=12.98)
+        Comment.objects.create(item=item, author=self.author, description='')
+        Photo.objects.create(item=item, author=self.author, picture=create_image())
+
+    def get_counts(self):
+        return [model.objects.count() for model in [Item, Comment, Photo, Rating, Reaction, User]]
+
+    def test_every_endpoint_succeeds_and_is_rolled_back(self):
+        counts = self.get_counts()
+        out = io.StringIO()
+        call_command('explain_queries', stdout=out)
+
+        statuses = {line.split()[0]: int(line.split(' -> ')[1].split(',')[0])
+                    for line in out.getvalue().splitlines() if ' -> ' in line}
+        for name in ['update', 'destroy', 'add_photo', 'login', 'comment-create', 'comment-update',
+                     'comment-destroy', 'photo-create', 'photo-update', 'photo-destroy',
+                     'search_bounding_box-stream', 'search_bounding_box-limit', 'search_bounding_box-markers']:
+            self.assertIn(name, statuses)
+        self.assertEqual([name for name, status in statuses.items() if not 200 <= status < 300], [])
+        self.assertEqual(self.get_counts(), counts)
@@ -0,0 +1,94 @@
+"""
+Map tile cache for location based queries.
+
+Items are grouped into tiles, the cells of level `Configurations.TILE_LEVEL`. The serialized items of a tile are
+cached under a key holding the current version of the tile, and writing an item replaces the version of its tile,
+so stale entries are never read again and simply expire. Only the item columns are cached, with the id of the
+author, since profiles change without their items.
+"""
+
+import uuid
+
+from django.core.cache import cache
+
+from item import spatial
+from project_hermes.hermes_config import Configurations
+
+
+def get_tile(cell):
+    """
+    Returns the tile of a full resolution cell key
+    """
+
+    return cell >> (2 * (spatial.LEVELS - Configurations.TILE_LEVEL))
+
+
+def get_tiles(min_latitude, max_latitude, min_longitude, max_longitude):
+    """
+    Returns the tiles which intersect the box, None when there are more than `MAX_CACHED_TILES` of them
+    """
+
+    if spatial.count_cells(min_latitude, max_latitude, min_longitude, max_longitude,
+                           Configurations.TILE_LEVEL) > Configurations.MAX_CACHED_TILES:
+        return None
+    return spatial.get_cells(min_latitude, max_latitude, min_longitude, max_longitude, Configurations.TILE_LEVEL)
+
+
+def get_tile_range(tile):
+    return spatial.get_cell_range(tile, Configurations.TILE_LEVEL)
+
+
+def _version_key(tile):
+    return 'item:tile:version:%d:%d' % (Configurations.TILE_LEVEL, tile)
+
+
+# Changed with the format of the cached items
+TILE_FORMAT = 2
+
+
+def _tile_key(tile, version):
+    return 'item:tile:%d:%d:%d:%s' % (TILE_FORMAT, Configurations.TILE_LEVEL, tile, version)
+
+
+def get_tile_versions(tiles):
+    keys = {tile: _version_key(tile) for tile in tiles}
+    versions = cache.get_many(list(keys.values()))
+
+    response = {}
+    for tile, key in keys.items():
+        version = versions.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        response[tile] = version
+    return response
+
+
+def get_cached_tiles(tiles, load):
+    """
+    Returns the cached contents of every tile, `load` is called with the tiles missing from the cache and must
+    return their contents by tile
+    """
+
+    versions = get_tile_versions(tiles)
+    keys = {tile: _tile_key(tile, versions[tile]) for tile in tiles}
+    cached = cache.get_many(list(keys.values()))
+
+    response = {}
+    missing = []
+    for tile, key in keys.items():
+        if key in cached:
+            response[tile] = cached[key]
+        else:
+            missing.append(tile)
+
+    if missing:
+        loaded = load(missing)
+        cache.set_many({keys[tile]: loaded[tile] for tile in missing}, Configurations.TILE_CACHE_TIMEOUT)
+        response.update(loaded)
+    return response
+
+
+def invalidate_tile(cell):
+    cache.set(_version_key(get_tile(cell)), uuid.uuid4().hex, None)
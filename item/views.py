@@ -1,59 +1,138 @@
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.db import transaction
+from django.db.models import Q, F, Count, Avg, Max, Sum
+from django.http import StreamingHttpResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 
 # Create your views here.
 from rest_framework import viewsets
 from rest_framework.decorators import list_route, detail_route
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN
+from rest_framework.settings import api_settings
+from rest_framework.status import HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_304_NOT_MODIFIED
+from rest_framework.utils.encoders import JSONEncoder
 
 from account.models import UserProfile
+from account.profiles import get_profile, get_profile_id
+from account.serializers import UserProfileSerializer
+from account.stats import add_stats
 from item.models import Item, Comment, Reaction, ReactionChoices, Photo, Rating, ItemStatusChoices, WashroomTypes, \
-    ItemFlags
+    ItemFlags, RecomputeJobKinds, DeletedItem, nearest_index, count_when
 from item.serializers import CreateItemSerializer, ItemSerializer, BoundingBoxSerializer, CommentSerializer, \
     PhotoSerializer, UpdateItemSerializer, AddRatingSerializer, AddCommentSerializer, \
-    AddPhotoSerializer, RatingSerializer, ItemFlagsSerializer
+    AddPhotoSerializer, RatingSerializer, ItemFlagsSerializer, NearestSerializer, ChangesSinceSerializer, \
+    MarkerSerializer, TileItemSerializer
+from item.pagination import KeysetPagination
+from item.renderers import MarkerJSONRenderer, MarkerBinaryRenderer
+from item import spatial, tile_cache
+from item.jobs import enqueue
+from item.reputation import add_reputation, add_item_change, get_item_counters, get_item_score
 from project_hermes.hermes_config import Configurations
 
 
-def get_author(user):
-    return UserProfile.objects.filter(user=user).first()
-
-
-def recalculate_reputation(profile: UserProfile):
-    comments = Comment.objects.filter(author=profile)
-    photos = Photo.objects.filter(author=profile)
-    reactions = Reaction.objects.filter(author=profile).count()
-
-    reputation = 0
-    for comment in comments:
-        reputation += comment.experience
-    for photo in photos:
-        reputation += photo.experience
-    reputation += reactions
+def conditional_on_item(view):
+    """
+    Makes a read of the item in the `pk` url argument answer conditional requests from the item version
+    """
 
-    items = Item.objects.filter(author=profile)
-    for item in items:
-        reputation += 5
-        if item.ratings.count() > 5:
-            reputation += 5
-        if item.comments.count() > 5:
-            reputation += 5
-        if item.photos.count() > 5:
-            reputation += 5
-        if item.flags > 5:
-            reputation -= 15
-        if 0 < item.flags <= 5:
-            reputation -= 5
+    @wraps(view)
+    def conditional_view(self, request, *args, **kwargs):
+        return self.get_conditional_response(request, kwargs['pk'], lambda: view(self, request, *args, **kwargs))
 
-    profile.reputation = reputation
-    profile.save()
+    return conditional_view
 
 
 class ItemViewSet(viewsets.ModelViewSet):
     queryset = Item.objects.all()
     serializer_class = ItemSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    renderer_classes = list(api_settings.DEFAULT_RENDERER_CLASSES) + [MarkerJSONRenderer, MarkerBinaryRenderer]
+
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
+
+    @staticmethod
+    def wants_markers(request):
+        return isinstance(request.accepted_renderer, (MarkerJSONRenderer, MarkerBinaryRenderer))
+
+    # Rows of the item whose authors are embedded in the conditional reads, besides the author of the item
+    embedded_authors = {'get_comments': Comment, 'get_photos': Photo}
+
+    def get_authors_state(self, pk, author_state):
+        """
+        Returns the sum of the versions and the last change of the profiles embedded in the response of the action.
+        The sum moves with every change, since the item version moves whenever its comments or photos do.
+        """
+
+        if self.action == 'retrieve':
+            return author_state
+        if self.action in self.embedded_authors:
+            state = self.embedded_authors[self.action].objects.filter(item_id=pk) \
+                .aggregate(version=Sum('author__version'), updated_at=Max('author__updated_at'))
+            return state['version'] or 0, state['updated_at']
+        return 0, None
+
+    def get_conditional_response(self, request, pk, build):
+        """
+        Answers conditional reads of an item from its version and the versions of the embedded authors alone,
+        `build` creates the full response otherwise
+        """
+
+        state = Item.objects.filter(pk=pk).values_list('version', 'updated_at', 'author__version',
+                                                       'author__updated_at').first()
+        if state is None:
+            raise Http404
+        version, updated_at = state[:2]
+        authors_version, authors_updated_at = self.get_authors_state(pk, state[2:])
+
+        etag = quote_etag('%s-%s-%s-%s-%s' % (pk, version, authors_version, request.user.pk or 0, self.action))
+        last_modified = int(max(updated_at, authors_updated_at or updated_at).timestamp())
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+        else:
+            not_modified = if_modified_since is not None and last_modified <= if_modified_since
+
+        response = Response(status=HTTP_304_NOT_MODIFIED) if not_modified else build()
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    @conditional_on_item
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        if self.wants_markers(request):
+            page = self.paginate_queryset(self.filter_queryset(Item.objects.only(*MarkerSerializer.fields)))
+            # The cursors sit next to the columns, where the binary format sends them as headers
+            markers = MarkerSerializer(page).data
+            markers['next'] = self.paginator.get_next_link()
+            markers['previous'] = self.paginator.get_previous_link()
+            markers['estimated_count'] = self.paginator.estimated_count
+            return Response(markers)
+        return super().list(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        # Comments, photos, ratings and reactions go with the item, recompute everyone who had a share in them
+        profile_ids = {instance.author_id}
+        for model in [Comment, Photo, Rating]:
+            profile_ids.update(model.objects.filter(item=instance).values_list('author_id', flat=True))
+        profile_ids.update(Reaction.objects.filter(Q(reactable__comment__item=instance) |
+                                                   Q(reactable__photo__item=instance))
+                           .values_list('author_id', flat=True))
+        instance.delete()
+        enqueue(RecomputeJobKinds.REPUTATION, *profile_ids)
+        enqueue(RecomputeJobKinds.PROFILE_STATS, *profile_ids)
 
     @staticmethod
     def is_valid_location(latitude, longitude):
@@ -70,6 +149,114 @@ class ItemViewSet(viewsets.ModelViewSet):
         else:
             return WashroomTypes.NONE
 
+    @classmethod
+    def get_clusters(cls, items, level):
+        """
+        Groups the items by their parent cell at the level, in a single aggregate query over the cell keys
+        """
+
+        clusters = items.order_by().annotate(cluster=F('cell') / (4 ** (spatial.LEVELS - level))) \
+            .values('cluster').annotate(count=Count('id'),
+                                        latitude=Avg('latitude'),
+                                        longitude=Avg('longitude'),
+                                        rating=Max('rating'),
+                                        free=count_when(is_free=True),
+                                        male=count_when(gender=WashroomTypes.MALE),
+                                        female=count_when(gender=WashroomTypes.FEMALE),
+                                        both=count_when(gender=WashroomTypes.BOTH),
+                                        none=count_when(gender=WashroomTypes.NONE))
+
+        response = []
+        for cluster in clusters:
+            response.append({'cell': cluster['cluster'],
+                             'count': cluster['count'],
+                             'latitude': cluster['latitude'],
+                             'longitude': cluster['longitude'],
+                             'rating': cluster['rating'],
+                             'is_free': cluster['free'],
+                             'gender': {'male': cluster['male'], 'female': cluster['female'],
+                                        'both': cluster['both'], 'none': cluster['none']}})
+        return response
+
+    @staticmethod
+    def filter_items(items, filters):
+        if filters.get('gender'):
+            items = items.filter(gender__in=filters['gender'])
+        if filters.get('is_free') is not None:
+            items = items.filter(is_free=filters['is_free'])
+        if filters.get('min_rating') is not None:
+            items = items.filter(rating__gte=filters['min_rating'])
+        if filters.get('verified_only'):
+            items = items.filter(status=ItemStatusChoices.VERIFIED)
+        return items
+
+    @staticmethod
+    def matches_filters(result, filters):
+        return (not filters.get('gender') or result['gender'] in filters['gender']) and \
+               (filters.get('is_free') is None or result['is_free'] == filters['is_free']) and \
+               (filters.get('min_rating') is None or result['rating'] >= filters['min_rating']) and \
+               (not filters.get('verified_only') or result['status'] == ItemStatusChoices.VERIFIED)
+
+    def get_cached_results(self, request, tiles, box):
+        """
+        Returns the items of the box from the tile cache, loading the missing tiles in one query. The tiles only
+        hold the item columns, the authors are loaded for every request in one more query.
+        """
+
+        def load(missing):
+            cells = Q()
+            for tile in missing:
+                cells |= Q(cell__range=tile_cache.get_tile_range(tile))
+            items = list(Item.objects.filter(cells).exclude(status=ItemStatusChoices.REMOVED).order_by('id'))
+
+            contents = {tile: [] for tile in missing}
+            for item, result in zip(items, TileItemSerializer(items, many=True).data):
+                contents[tile_cache.get_tile(item.cell)].append(result)
+            return contents
+
+        results = []
+        for contents in tile_cache.get_cached_tiles(tiles, load).values():
+            for result in contents:
+                if (box['min_latitude'] <= result['latitude'] <= box['max_latitude'] and
+                        box['min_longitude'] <= result['longitude'] <= box['max_longitude'] and
+                        result['id'] > box['after'] and self.matches_filters(result, box)):
+                    results.append(result)
+
+        authors = ItemSerializer.setup_author_loading(UserProfile.objects.filter(
+            pk__in={result['author'] for result in results}))
+        authors = {author.pk: author for author in authors}
+        payloads = {}
+        for index, result in enumerate(results):
+            author = authors.get(result['author'])
+            if author is None or (result['is_anonymous'] and author.user_id != request.user.pk):
+                results[index] = dict(result, author=None)
+                continue
+            if author.pk not in payloads:
+                payloads[author.pk] = UserProfileSerializer(author).data
+            results[index] = dict(result, author=payloads[author.pk])
+
+        results.sort(key=lambda result: result['id'])
+        return results
+
+    def stream_items(self, request, items):
+        """
+        Yields the items as a json document, serialized in chunks read by keyset pagination on the id
+        """
+
+        yield '{"results": ['
+        last_id, separator = None, ''
+        while True:
+            chunk = items if last_id is None else items.filter(id__gt=last_id)
+            chunk = list(chunk[:Configurations.STREAM_CHUNK_SIZE])
+            if not chunk:
+                break
+
+            for result in self.serializer_class(chunk, many=True, context={'request': request}).data:
+                yield separator + json.dumps(result, cls=JSONEncoder)
+                separator = ', '
+            last_id = chunk[-1].id
+        yield ']}'
+
     def create(self, request, *args, **kwargs):
         """
         create the item
@@ -85,8 +272,9 @@ class ItemViewSet(viewsets.ModelViewSet):
             if not self.is_valid_location(latitude, longitude):
                 return Response({'success': False, 'message': 'Incorrect Location'}, status=HTTP_400_BAD_REQUEST)
 
-            item = Item.objects.filter(author__user=request.user, longitude=longitude, latitude=latitude).first()
-            author = get_author(request.user)
+            item = Item.objects.filter(author_id=get_profile_id(request.user), longitude=longitude,
+                                       latitude=latitude).first()
+            author = get_profile(request.user)
             status = ItemStatusChoices.UNVERIFIED if author.reputation < Configurations.AUTO_VERIFICATION_REPUTATION else ItemStatusChoices.VERIFIED
             if not item:
                 item = Item.objects.create(
@@ -101,7 +289,8 @@ class ItemViewSet(viewsets.ModelViewSet):
                         gender=self.get_washroom_type(serialized_data.validated_data['male'],
                                                       serialized_data.validated_data['female'])
                 )
-            recalculate_reputation(author)
+                add_reputation(author.pk, get_item_score(get_item_counters(item)))
+                add_stats(author.pk, items_count=1)
             return Response(self.serializer_class(item).data)
         else:
             return Response(serialized_data.errors, status=HTTP_400_BAD_REQUEST)
@@ -122,20 +311,124 @@ class ItemViewSet(viewsets.ModelViewSet):
             min_longitude = serialized_data.validated_data['min_longitude']
             max_longitude = serialized_data.validated_data['max_longitude']
 
-            items = self.get_queryset().filter(latitude__range=[min_latitude, max_latitude],
-                                               longitude__range=[min_longitude, max_longitude]).exclude(status=ItemStatusChoices.REMOVED)
+            cells = Q()
+            for low, high in spatial.get_covering_ranges(min_latitude, max_latitude, min_longitude, max_longitude):
+                cells |= Q(cell__range=[low, high])
+
+            items = self.get_queryset().filter(cells).filter(latitude__range=[min_latitude, max_latitude],
+                                                             longitude__range=[min_longitude, max_longitude]) \
+                .exclude(status=ItemStatusChoices.REMOVED)
+            items = self.filter_items(items, serialized_data.validated_data)
+
+            zoom = serialized_data.validated_data.get('zoom')
+            max_points = serialized_data.validated_data.get('max_points')
+            if zoom is not None or max_points is not None:
+                # Always bounded by the size of the box, whatever the zoom
+                level = spatial.get_cluster_level(min_latitude, max_latitude, min_longitude, max_longitude,
+                                                  max_points or Configurations.MAX_CLUSTERS, zoom)
+                return Response({'level': level, 'clusters': self.get_clusters(items, level)})
+
+            items = items.filter(id__gt=serialized_data.validated_data['after']).order_by('id')
+            limit = serialized_data.validated_data.get('limit')
+            if self.wants_markers(request):
+                markers = MarkerSerializer(items[:limit] if limit is not None else items).data
+                if limit is not None:
+                    markers['next'] = markers['id'][-1] if markers['count'] == limit else None
+                return Response(markers)
+
+            if serialized_data.validated_data['stream']:
+                return StreamingHttpResponse(self.stream_items(request, items), content_type='application/json')
+
+            tiles = tile_cache.get_tiles(min_latitude, max_latitude, min_longitude, max_longitude)
+            if tiles is not None:
+                results = self.get_cached_results(request, tiles, serialized_data.validated_data)
+                if limit is not None:
+                    results = results[:limit]
+            else:
+                if limit is not None:
+                    items = items[:limit]
+                results = self.serializer_class(items, many=True, context={'request': request}).data
+
             response = {
-                'results': self.serializer_class(items, many=True, context={'request': request}).data
+                'results': results
             }
+            if limit is not None:
+                response['next'] = results[-1]['id'] if len(results) == limit else None
             return Response(response)
         else:
             return Response({'success': False, 'message': 'Incorrect Data Sent'}, status=HTTP_400_BAD_REQUEST)
 
+    @list_route(methods=['POST'], permission_classes=[])
+    def changes_since(self, request):
+        """
+        Get the items of the Bounding Box created, updated or removed after `since`.
+        The returned watermark is sent as `since` on the next sync.
+        ---
+        request_serializer: ChangesSinceSerializer
+        """
+
+        serialized_data = ChangesSinceSerializer(data=request.data)
+
+        if serialized_data.is_valid():
+            watermark = timezone.now() - timedelta(seconds=Configurations.SYNC_WATERMARK_OVERLAP)
+            box = {'latitude__range': [serialized_data.validated_data['min_latitude'],
+                                       serialized_data.validated_data['max_latitude']],
+                   'longitude__range': [serialized_data.validated_data['min_longitude'],
+                                        serialized_data.validated_data['max_longitude']]}
+            items = self.get_queryset().filter(updated_at__gt=serialized_data.validated_data['since'], **box) \
+                .order_by('id')
+            deleted = DeletedItem.objects.filter(deleted_at__gt=serialized_data.validated_data['since'], **box)
+
+            removed_status = [ItemStatusChoices.DELETED, ItemStatusChoices.REMOVED]
+            removed = list(items.filter(status__in=removed_status).values_list('id', flat=True))
+            removed.extend(deleted.values_list('item_id', flat=True))
+            response = {
+                'results': self.serializer_class(items.exclude(status__in=removed_status), many=True,
+                                                 context={'request': request}).data,
+                'removed': sorted(removed),
+                'watermark': watermark,
+            }
+            return Response(response)
+        else:
+            return Response({'success': False, 'message': 'Incorrect Data Sent'}, status=HTTP_400_BAD_REQUEST)
+
+    @list_route(methods=['POST'], permission_classes=[])
+    def nearest(self, request):
+        """
+        Get the nearest items sorted by distance in kilometers
+        ---
+        request_serializer: NearestSerializer
+        """
+
+        serialized_data = NearestSerializer(data=request.data)
+
+        if serialized_data.is_valid():
+            latitude = serialized_data.validated_data['latitude']
+            longitude = serialized_data.validated_data['longitude']
+
+            if not self.is_valid_location(latitude, longitude):
+                return Response({'success': False, 'message': 'Incorrect Location'}, status=HTTP_400_BAD_REQUEST)
+
+            neighbours = nearest_index.nearest(latitude, longitude, serialized_data.validated_data['k'],
+                                               serialized_data.validated_data.get('max_distance'))
+            items = self.get_queryset().exclude(status=ItemStatusChoices.REMOVED) \
+                .in_bulk([pk for distance, pk in neighbours])
+
+            results = []
+            for distance, pk in neighbours:
+                if pk in items:
+                    result = self.serializer_class(items[pk], context={'request': request}).data
+                    result['distance'] = distance
+                    results.append(result)
+            return Response({'results': results})
+        else:
+            return Response({'success': False, 'message': 'Incorrect Data Sent'}, status=HTTP_400_BAD_REQUEST)
+
     @detail_route(permission_classes=[IsAuthenticated])
     def get_user_comment(self, request, pk):
         item = get_object_or_404(Item, pk=pk)
-        comment = Comment.objects.filter(author__user=request.user, item=item).first()
-        rating = Rating.objects.filter(author__user=request.user, item=item).first()
+        comment = Comment.objects.filter(author_id=get_profile_id(request.user), item=item).first()
+        rating = Rating.objects.filter(author_id=get_profile_id(request.user), item=item).first()
         response = {'has_comment': False, 'has_rating': False}
         if comment:
             response['has_comment'] = True
@@ -147,32 +440,38 @@ class ItemViewSet(viewsets.ModelViewSet):
         return Response(response)
 
     @detail_route()
+    @conditional_on_item
     def get_comments(self, request, pk):
         item = get_object_or_404(Item, pk=pk)
-        comments = item.comments.all().order_by('-experience')
+        comments = CommentSerializer.setup_eager_loading(item.comments.all()).order_by('-experience')
         response = {
             'results': CommentSerializer(comments, many=True, context={'request': request}).data
         }
         return Response(response)
 
     @detail_route()
+    @conditional_on_item
     def get_stars(self, request, pk):
-        item = get_object_or_404(Item, pk=pk)
+        item = get_object_or_404(Item.objects.only('id', *Item.star_fields.values()), pk=pk)
+        counts = {stars: getattr(item, field) for stars, field in Item.star_fields.items()}
+        if None in counts.values():
+            counts = {stars: 0 for stars in Item.star_fields}
+            counts.update(Rating.objects.filter(item=item, rating__in=list(Item.star_fields)).order_by()
+                          .values_list('rating').annotate(count=Count('pk')))
+
         stars = dict()
-        stars['1'] = Rating.objects.filter(item=item, rating=1).count()
-        stars['2'] = Rating.objects.filter(item=item, rating=2).count()
-        stars['3'] = Rating.objects.filter(item=item, rating=3).count()
-        stars['4'] = Rating.objects.filter(item=item, rating=4).count()
-        stars['5'] = Rating.objects.filter(item=item, rating=5).count()
+        for star, count in counts.items():
+            stars[str(int(star))] = count
         response = {
             'results': stars
         }
         return Response(response)
 
     @detail_route()
+    @conditional_on_item
     def get_photos(self, request, pk):
         item = get_object_or_404(Item, pk=pk)
-        photos = item.photos.all()
+        photos = PhotoSerializer.setup_eager_loading(item.photos.all())
         response = {
             'results': PhotoSerializer(photos, many=True, context={'request': request}).data
         }
@@ -187,7 +486,7 @@ class ItemViewSet(viewsets.ModelViewSet):
 
         serialized_data = UpdateItemSerializer(data=request.data)
         item = self.get_object()
-        if item.author.user != request.user:
+        if item.author_id != get_profile_id(request.user):
             return Response({'success': False, 'message': 'Unauthorized Access'}, status=HTTP_403_FORBIDDEN)
 
         if serialized_data.is_valid():
@@ -198,7 +497,6 @@ class ItemViewSet(viewsets.ModelViewSet):
                                                  serialized_data.validated_data['female'])
             item.is_free = serialized_data.validated_data['is_free']
             item.save()
-            recalculate_reputation(item.author)
             return Response(self.serializer_class(item, context={'request': request}).data)
         else:
             return Response({'success': False, 'message': 'Incorrect Data Sent'}, status=HTTP_400_BAD_REQUEST)
@@ -218,26 +516,47 @@ class ItemViewSet(viewsets.ModelViewSet):
             if not (0.0 <= stars <= 5.0):
                 return Response({'success': False, 'message': 'Incorrect Rating'}, status=HTTP_400_BAD_REQUEST)
 
-            rating = Rating.objects.filter(item=item, author__user=request.user).first()
-            if rating:
-                rating.is_anonymous = serialized_data.validated_data['is_anonymous']
-                rating.rating = stars
-                rating.save()
-
-                item.recalculate_rating()
-                item.save()
-
-            else:
-                rating = Rating.objects.create(
-                        rating=stars,
-                        item=item,
-                        author=get_author(request.user),
-                        is_anonymous=serialized_data.validated_data['is_anonymous'],
-                )
-
-                item.recalculate_rating()
-                item.save()
-            recalculate_reputation(rating.author)
+            with transaction.atomic():
+                rating = Rating.objects.select_for_update() \
+                    .filter(item=item, author_id=get_profile_id(request.user)).first()
+                if rating:
+                    previous_stars = rating.rating
+                    previous_sum, previous_weight = rating.rating * rating.weight, rating.weight
+                    rating.is_anonymous = serialized_data.validated_data['is_anonymous']
+                    rating.rating = stars
+                    rating.weight = rating.get_weight()
+                    rating.save()
+
+                    counters = {'rating_sum': rating.rating * rating.weight - previous_sum,
+                                'rating_weight': rating.weight - previous_weight}
+                    if previous_stars != stars:
+                        if previous_stars in Item.star_fields:
+                            counters[Item.star_fields[previous_stars]] = -1
+                        if stars in Item.star_fields:
+                            counters[Item.star_fields[stars]] = 1
+                    previous = item.touch(**counters)
+
+                else:
+                    rating = Rating(
+                            rating=stars,
+                            item=item,
+                            author_id=get_profile_id(request.user),
+                            is_anonymous=serialized_data.validated_data['is_anonymous'],
+                    )
+                    rating.weight = rating.get_weight()
+                    rating.save()
+
+                    counters = {'ratings_count': 1, 'rating_sum': rating.rating * rating.weight,
+                                'rating_weight': rating.weight}
+                    add_stats(rating.author_id, ratings_count=1)
+                    if stars in Item.star_fields:
+                        counters[Item.star_fields[stars]] = 1
+                    previous = item.touch(**counters)
+
+                enqueue(RecomputeJobKinds.ITEM, item.pk)
+            add_item_change(item, previous)
+            # The rating is written by the recompute job, the running sums are already current
+            item.update_rating()
 
             response = {
                 'success': True,
@@ -256,15 +575,15 @@ class ItemViewSet(viewsets.ModelViewSet):
         """
 
         item = self.get_object()
-        user_flag = ItemFlags.objects.filter(item=item, author__user=request.user).first()
+        user_flag = ItemFlags.objects.filter(item=item, author_id=get_profile_id(request.user)).first()
         if not user_flag:
             user_flag = ItemFlags.objects.create(
                 item=item,
-                author=get_author(request.user)
+                author_id=get_profile_id(request.user)
             )
 
-            item.flags = ItemFlags.objects.filter(item=item, author__user=request.user).count()
-            item.save()
+            add_item_change(item, item.touch(flags=1))
+            enqueue(RecomputeJobKinds.ITEM, item.pk)
 
         response = {
             'success': True,
@@ -284,19 +603,22 @@ class ItemViewSet(viewsets.ModelViewSet):
         item = self.get_object()
         serialized_data = AddCommentSerializer(data=request.data)
         if serialized_data.is_valid():
-            comment = Comment.objects.filter(item=item, author__user=request.user).first()
+            comment = Comment.objects.filter(item=item, author_id=get_profile_id(request.user)).first()
             if comment:
                 comment.description = serialized_data.validated_data['description']
                 comment.is_anonymous = serialized_data.validated_data['is_anonymous']
                 comment.save()
+                item.touch()
             else:
                 comment = Comment.objects.create(
                         description=serialized_data.validated_data['description'],
                         item=item,
-                        author=get_author(request.user),
+                        author=get_profile(request.user),
                         is_anonymous=serialized_data.validated_data['is_anonymous'],
                 )
-            recalculate_reputation(comment.author)
+                add_item_change(item, item.touch(comments_count=1))
+                add_stats(comment.author_id, comments_count=1)
+                enqueue(RecomputeJobKinds.ITEM, item.pk)
             response = {
                 'success': True,
                 'result': CommentSerializer(comment).data
@@ -320,9 +642,11 @@ class ItemViewSet(viewsets.ModelViewSet):
                     picture=serialized_data.validated_data['picture'],
                     item=item,
                     is_anonymous=serialized_data.validated_data['is_anonymous'],
-                    author=get_author(request.user),
+                    author=get_profile(request.user),
             )
-            recalculate_reputation(photo.author)
+            add_item_change(item, item.touch(photos_count=1))
+            add_stats(photo.author_id, photos_count=1)
+            enqueue(RecomputeJobKinds.ITEM, item.pk)
             response = {
                 'success': True,
                 'result': PhotoSerializer(photo).data
@@ -333,89 +657,70 @@ class ItemViewSet(viewsets.ModelViewSet):
 
 
 class ReactableViewSet(viewsets.ModelViewSet):
-    @staticmethod
-    def handle_upvote(request, pk, reactable):
-        reaction = Reaction.objects.filter(author__user=request.user, reactable=reactable) \
-            .exclude(reaction=ReactionChoices.FLAG).first()
-        if reaction:
-            reaction.reaction = ReactionChoices.UPVOTE
-            reaction.save()
-        else:
-            Reaction.objects.create(
-                    reaction=ReactionChoices.UPVOTE,
-                    reactable=reactable,
-                    author=get_author(request.user),
-            )
-
-        reactable.recalculate_votes()
-        reactable.recalculate_score()
-        reactable.save()
-
-        return reactable
-
-    @staticmethod
-    def handle_downvote(request, pk, reactable):
-        reaction = Reaction.objects.filter(author__user=request.user, reactable=reactable) \
-            .exclude(reaction=ReactionChoices.FLAG).first()
-        if reaction:
-            reaction.reaction = ReactionChoices.DOWNVOTE
-            reaction.save()
-
-        else:
-            Reaction.objects.create(
-                    reaction=ReactionChoices.DOWNVOTE,
-                    reactable=reactable,
-                    author=get_author(request.user),
-            )
-
-        reactable.recalculate_votes()
-        reactable.recalculate_score()
-        reactable.save()
-
-        return reactable
+    item_counter = None
+
+    def get_queryset(self):
+        return self.serializer_class.setup_eager_loading(super().get_queryset())
+
+    def perform_create(self, serializer):
+        reactable = serializer.save(author=get_profile(self.request.user))
+        add_item_change(reactable.item, reactable.item.touch(**{self.item_counter: 1}))
+        add_stats(reactable.author_id, **{self.item_counter: 1})
+        enqueue(RecomputeJobKinds.ITEM, reactable.item_id)
+
+    def perform_update(self, serializer):
+        # The item is read only once created, so only this item shows the change
+        reactable = serializer.save()
+        reactable.item.touch()
+
+    def perform_destroy(self, instance):
+        add_item_change(instance.item, instance.item.touch(**{self.item_counter: -1}))
+        add_stats(instance.author_id, **{self.item_counter: -1})
+        enqueue(RecomputeJobKinds.ITEM, instance.item_id)
+        add_reputation(instance.author_id, -instance.experience)
+        reactions = Reaction.objects.filter(reactable=instance).order_by().values_list('author_id') \
+            .annotate(count=Count('pk'))
+        for author_id, count in reactions:
+            add_reputation(author_id, -count)
+        instance.delete()
 
     @staticmethod
-    def handle_flag(request, pk, reactable):
-        reaction = Reaction.objects.filter(author__user=request.user, reactable=reactable,
-                                           reaction=ReactionChoices.FLAG).first()
-        if not reaction:
-            Reaction.objects.create(
-                    reaction=ReactionChoices.FLAG,
-                    reactable=reactable,
-                    author=get_author(request.user),
-            )
-
-        reactable.recalculate_votes()
-        reactable.recalculate_score()
-        reactable.save()
+    def handle_reaction(request, reactable, reaction, flag=False):
+        author_id = get_profile_id(request.user)
+        # The reaction and the counters moved by it are committed together
+        with transaction.atomic():
+            previous = Reaction.set_reaction(reactable.pk, author_id, reaction, flag)
+            if previous is None and reaction is not None:
+                add_reputation(author_id, 1)
+            elif previous is not None and reaction is None:
+                add_reputation(author_id, -1)
+
+            if reactable.change_vote(previous, reaction):
+                # The counters are part of the comments and photos of the item, so its version moves with them
+                reactable.item.touch()
+                enqueue(RecomputeJobKinds.REACTABLE, reactable.pk)
 
         return reactable
 
-    @staticmethod
-    def handle_unflag(request, pk, reactable):
-        reaction = Reaction.objects.filter(author__user=request.user, reactable=reactable,
-                                           reaction=ReactionChoices.FLAG).first()
-        if reaction:
-            reaction.delete()
-
-        reactable.recalculate_votes()
-        reactable.recalculate_score()
-        reactable.save()
+    @classmethod
+    def handle_upvote(cls, request, pk, reactable):
+        return cls.handle_reaction(request, reactable, ReactionChoices.UPVOTE)
 
-        return reactable
+    @classmethod
+    def handle_downvote(cls, request, pk, reactable):
+        return cls.handle_reaction(request, reactable, ReactionChoices.DOWNVOTE)
 
-    @staticmethod
-    def handle_unvote(request, pk, reactable):
-        reaction = Reaction.objects.filter(author__user=request.user, reactable=reactable) \
-            .exclude(reaction=ReactionChoices.FLAG).first()
-        if reaction:
-            reaction.delete()
+    @classmethod
+    def handle_flag(cls, request, pk, reactable):
+        return cls.handle_reaction(request, reactable, ReactionChoices.FLAG, flag=True)
 
-        reactable.recalculate_votes()
-        reactable.recalculate_score()
-        reactable.save()
+    @classmethod
+    def handle_unflag(cls, request, pk, reactable):
+        return cls.handle_reaction(request, reactable, None, flag=True)
 
-        return reactable
+    @classmethod
+    def handle_unvote(cls, request, pk, reactable):
+        return cls.handle_reaction(request, reactable, None)
 
     @detail_route(methods=['POST'], permission_classes=[IsAuthenticated])
     def upvote(self, request, pk):
@@ -426,8 +731,6 @@ class ReactableViewSet(viewsets.ModelViewSet):
         """
 
         reactable = self.handle_upvote(request, pk, self.get_object())
-        recalculate_reputation(reactable.author)
-        recalculate_reputation(get_author(request.user))
         response = {
             'result': self.serializer_class(reactable).data
         }
@@ -442,8 +745,6 @@ class ReactableViewSet(viewsets.ModelViewSet):
         """
 
         reactable = self.handle_downvote(request, pk, self.get_object())
-        recalculate_reputation(reactable.author)
-        recalculate_reputation(get_author(request.user))
         response = {
             'result': self.serializer_class(reactable).data
         }
@@ -458,8 +759,6 @@ class ReactableViewSet(viewsets.ModelViewSet):
         """
 
         reactable = self.handle_flag(request, pk, self.get_object())
-        recalculate_reputation(reactable.author)
-        recalculate_reputation(get_author(request.user))
         response = {
             'result': self.serializer_class(reactable).data
         }
@@ -474,8 +773,6 @@ class ReactableViewSet(viewsets.ModelViewSet):
         """
 
         reactable = self.handle_unvote(request, pk, self.get_object())
-        recalculate_reputation(reactable.author)
-        recalculate_reputation(get_author(request.user))
         response = {
             'result': self.serializer_class(reactable).data
         }
@@ -490,8 +787,6 @@ class ReactableViewSet(viewsets.ModelViewSet):
         """
 
         reactable = self.handle_unflag(request, pk, self.get_object())
-        recalculate_reputation(reactable.author)
-        recalculate_reputation(get_author(request.user))
         response = {
             'result': self.serializer_class(reactable).data
         }
@@ -502,9 +797,13 @@ class CommentViewSet(ReactableViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    item_counter = 'comments_count'
 
 
 class PhotoViewSet(ReactableViewSet):
     queryset = Photo.objects.all()
     serializer_class = PhotoSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
+    item_counter = 'photos_count'
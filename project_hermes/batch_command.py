@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Model
+
+
+class BatchCommand(BaseCommand):
+    """
+    Command checking or repairing every row of a table, read in keyset batches of `--batch-size` rows on the id.
+    Subclasses give the rows with `get_queryset` and handle a batch in `handle_batch`, which returns how many rows
+    it repaired or found mismatched.
+    """
+
+    subject = 'rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Run again every INTERVAL seconds instead of once')
+
+    def get_queryset(self, options):
+        raise NotImplementedError
+
+    def handle_batch(self, rows, options):
+        raise NotImplementedError
+
+    def report(self, checked, changed, options):
+        self.stdout.write('Checked %d %s, repaired %d' % (checked, self.subject, changed))
+
+    @staticmethod
+    def get_id(row):
+        if isinstance(row, Model):
+            return row.pk
+        if isinstance(row, dict):
+            return row['id']
+        return row
+
+    def run_batches(self, options):
+        checked = changed = 0
+        last_id = 0
+        while True:
+            rows = list(self.get_queryset(options).filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not rows:
+                break
+
+            changed += self.handle_batch(rows, options)
+            checked += len(rows)
+            last_id = self.get_id(rows[-1])
+
+        self.report(checked, changed, options)
+        return changed
+
+    def handle(self, *args, **options):
+        while True:
+            self.changed = self.run_batches(options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
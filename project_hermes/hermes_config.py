@@ -6,3 +6,24 @@ class Configurations:
     TRUSTED = 500
     EXPERT = 1000
     BANNED = -200
+    NEAREST_INDEX_MAX_AGE = 600
+    STREAM_CHUNK_SIZE = 200
+    TILE_LEVEL = 12
+    TILE_CACHE_TIMEOUT = 3600
+    MAX_CACHED_TILES = 64
+    SYNC_WATERMARK_OVERLAP = 5
+    MAX_CLUSTERS = 1024
+    RECOMPUTE_WORKERS = 4
+    RECOMPUTE_BATCH_SIZE = 100
+    RECOMPUTE_LEASE_TIMEOUT = 600
+    PROFILE_ID_CACHE_TIMEOUT = 24 * 3600
+    TOKEN_EXPIRY_DAYS = 30
+    TOKEN_TOUCH_INTERVAL = 600
+    TOKEN_CACHE_TIMEOUT = 300
+    TOKEN_LOCAL_CACHE_TIMEOUT = 30
+    TOKEN_LOCAL_CACHE_SIZE = 10000
+    GRAPH_CONNECT_TIMEOUT = 2
+    GRAPH_READ_TIMEOUT = 5
+    GRAPH_POOL_SIZE = 20
+    GRAPH_TOKEN_CACHE_TIMEOUT = 300
+    PROFILE_CACHE_TIMEOUT = 30
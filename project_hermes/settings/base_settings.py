@@ -112,5 +112,9 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
         'account.tokenauth.TokenAuthentication',
-    )
-}
\ No newline at end of file
+    ),
+    'PAGE_SIZE': 50,
+}
+
+# Facebook Graph API, point it to the fake_graph_server command to log in offline
+GRAPH_API_URL = os.environ.get('GRAPH_API_URL', 'https://graph.facebook.com/v2.5')